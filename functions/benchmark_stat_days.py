@@ -0,0 +1,73 @@
+"""
+Benchmark: pandas vs numpy engine for SongstatsClient.normalize_daily_stats (the get_stat_days_abs merge).
+Builds synthetic /artists/historic_stats payloads shaped like the real ones (several sources, 8 weeks of
+daily history, ragged dates and missing fields), checks both engines produce identical output and
+prints the per call timings.
+
+Usage:
+  cd functions
+  venv/bin/python3 benchmark_stat_days.py [iterations]
+"""
+
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from lib.songstats import SongstatsClient
+
+SOURCES = {
+  'spotify': ['streams_total', 'followers_total', 'monthly_listeners_current', 'popularity_current', 'playlists_current'],
+  'tiktok': ['followers_total', 'views_total', 'likes_total', 'videos_total'],
+  'instagram': ['followers_total', 'posts_total'],
+  'youtube': ['subscribers_total', 'video_views_total'],
+  'shazam': ['shazams_total'],
+}
+DAYS = 8 * 7
+
+
+def synthetic_stats(seed):
+  rng = random.Random(seed)
+  end = date.today()
+  stats = []
+  for source, fields in SOURCES.items():
+    history = []
+    for i in range(DAYS, -1, -1):
+      # sources drop days now and then, so the merged dates are a ragged union
+      if rng.random() < 0.1:
+        continue
+      record = {'date': (end - timedelta(days=i)).strftime('%Y-%m-%d')}
+      for field in fields:
+        if rng.random() < 0.05:
+          continue
+        record[field] = rng.randint(0, 5_000_000)
+      history.append(record)
+    stats.append({'source': source, 'data': {'history': history}})
+  return stats
+
+
+def time_engine(client, payloads, engine):
+  start = time.perf_counter()
+  results = [client.normalize_daily_stats(stats, engine) for stats in payloads]
+  return results, time.perf_counter() - start
+
+
+def main():
+  iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  client = SongstatsClient(None)
+  payloads = [synthetic_stats(i) for i in range(iterations)]
+
+  pandas_results, pandas_time = time_engine(client, payloads, 'pandas')
+  numpy_results, numpy_time = time_engine(client, payloads, 'numpy')
+
+  mismatches = sum(1 for a, b in zip(pandas_results, numpy_results) if a != b)
+  print(f"{iterations} payloads, {len(SOURCES)} sources x {DAYS + 1} days")
+  print(f"pandas: {pandas_time / iterations * 1000:.3f} ms/call")
+  print(f"numpy:  {numpy_time / iterations * 1000:.3f} ms/call ({pandas_time / numpy_time:.1f}x)")
+  print(f"mismatches: {mismatches}")
+  if mismatches > 0:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -920,14 +920,22 @@ def artist_joined_query():
     return query
 
 
-def artist_with_meta(sql_session, spotify_id = None, artist_id = None):
-    query = select(Artist).options(
+def artist_with_meta_query():
+    return select(Artist).options(
         joinedload(Artist.statistics, innerjoin=False).joinedload(Statistic.type, innerjoin=True),
         joinedload(Artist.links, innerjoin=False).joinedload(ArtistLink.source, innerjoin=True),
         joinedload(Artist.tags, innerjoin=False),
         joinedload(Artist.attributions_needing_notified, innerjoin=False)
     )
 
+def artists_with_meta(sql_session, artist_ids: list):
+    if len(artist_ids) == 0:
+        return []
+    return list(sql_session.scalars(artist_with_meta_query().where(Artist.id.in_(artist_ids))).unique())
+
+def artist_with_meta(sql_session, spotify_id = None, artist_id = None):
+    query = artist_with_meta_query()
+
     if spotify_id is not None:
         query = query.where(Artist.spotify_id == spotify_id)
     if artist_id is not None:
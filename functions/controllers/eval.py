@@ -7,7 +7,7 @@ from controllers.artists import artist_with_meta
 from datetime import datetime, timedelta
 import re
 from fuzzywuzzy import fuzz
-from google.cloud.firestore_v1.base_query import FieldFilter, BaseCompositeFilter, StructuredQuery
+from google.cloud.firestore_v1.base_query import BaseCompositeFilter, StructuredQuery
 
 
 #     "copyright_eval" : {
@@ -60,16 +60,11 @@ class EvalController():
     # get top tracks
     top_tracks = self.spotify.get_artist_top_tracks(spotify_id)['tracks']
     top_track_ids = list(map(lambda x: x['id'], top_tracks))
-    check_cache = self.db.collection("spotify_cache").where(filter=FieldFilter(
-        "spotify_id", "==", spotify_id
-    )).where(filter=FieldFilter(
-        'type', '==', 'top-tracks'
-    )).order_by('created_at', "DESCENDING").get()
-
-    cache_ref = check_cache.pop() if len(check_cache) > 0 else None
+    cache_ref = self.spotify.get_cache_doc(spotify_id, 'top-tracks')
     if cache_ref is None:
         cache_data = {"data": top_tracks, "spotify_id": spotify_id, "type": "top-tracks", "processed": False, "created_at": SERVER_TIMESTAMP}
-        update_time, cache_ref = self.db.collection("spotify_cache").add(cache_data)
+        cache_ref = self.spotify.cache_doc_ref(spotify_id, 'top-tracks')
+        cache_ref.set(cache_data)
     else:
         if cache_ref.get('processed'):
             previous_data = cache_ref.get('data')
@@ -116,7 +111,7 @@ class EvalController():
     if isinstance(cache_ref, DocumentSnapshot):
         cache_ref.reference.update({'processed': True})
     else:
-        cache_ref.set({'processed': True})
+        cache_ref.update({'processed': True})
     # eval spotify
     sp_evals = []
     p_lines = self.spotify.get_artist_recent_plines_with_dates(spotify_id)
@@ -2,7 +2,6 @@ import traceback
 from google.cloud.firestore_v1 import Client
 from lib import SongstatsClient, ErrorResponse, SpotifyClient, YoutubeClient, CloudSQLClient, CopyrightEvaluator, Artist
 from .artists import artist_with_meta
-from google.cloud.firestore_v1.base_query import FieldFilter
 
 class LookalikeController():
   def __init__(self, spotify: SpotifyClient, songstats : SongstatsClient, youtube: YoutubeClient, sql, db: Client):
@@ -40,13 +39,7 @@ class LookalikeController():
     if yt_artist is None:
       print("no yt artist found, fetching manually")
       # Get the artist from spotify - on cache if possible
-      check_cache = self.db.collection("spotify_cache").where(filter=FieldFilter(
-          "spotify_id", "==", sql_ref.spotify_id
-      )).where(filter=FieldFilter(
-          'type', '==', 'top-tracks'
-      )).order_by('created_at', "DESCENDING").get()
-
-      cache_ref = check_cache.pop() if len(check_cache) > 0 else None
+      cache_ref = self.spotify.get_cache_doc(sql_ref.spotify_id, 'top-tracks')
       if cache_ref != None:
         top_tracks = cache_ref.to_dict()['data']
       else:
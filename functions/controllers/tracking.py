@@ -6,15 +6,24 @@ from sqlalchemy import select, or_, func, and_, text
 from sqlalchemy.orm import joinedload, contains_eager
 import traceback
 
-from controllers.artists import artist_with_meta
-from lib import SongstatsClient, ErrorResponse, SpotifyClient, get_user, ArtistLink, LinkSource, StatisticType, \
+from controllers.artists import artist_with_meta, artists_with_meta
+from lib import SongstatsClient, ErrorResponse, SpotifyClient, get_user, ArtistLink, StatisticType, \
     OrganizationArtist, Evaluation, Statistic, UserArtist, Attribution, ArtistTag
 from datetime import datetime, timedelta
 from google.cloud.firestore_v1.base_query import FieldFilter, BaseCompositeFilter, StructuredQuery
 from google.cloud.firestore_v1.transforms import DELETE_FIELD
 
 from lib import CloudSQLClient, Artist
-from lib.utils import pop_default
+from lib.stat_archive import archive_statistics, archive_rows, load_archived_series
+from lib.stat_rollup import StatisticRollup
+from lib.stat_writer import StatisticsWriter
+from lib.songstats import BREAKER_OPEN_STATUS
+from lib.firestore_buffer import DocumentBuffer, buffered_documents
+from lib.concurrency import map_concurrently
+from lib.directory import user_directory
+from lib.bulk_import import ArtistImportBatch
+from lib.links import LinkNormalizer, link_normalizer
+from lib.reconcile import diff_by_key, apply_reconciliation
 
 HOT_TRACKING_FIELDS = {
   "spotify__monthly_listeners": "abs",
@@ -35,21 +44,28 @@ DEPRECATED_STATS = {
 }
 
 
+# concurrent songstats fetches per /update-artists batch
+STATS_FETCH_WORKERS = 5
+
+
 class TrackingController():
   def __init__(self, spotify: SpotifyClient, songstats : SongstatsClient, db: Client, twilio = None):
     self.spotify = spotify
     self.songstats = songstats
     self.db = db
     self.statistic_types = None
-    self.users = None
+    self.statistic_rollup = None
     self.twilio = twilio
+    # artists_v2 reads and writes of one request, see buffered_documents
+    self.documents = DocumentBuffer(db)
 
   def get_statistic_type_from_field(self, sql_session, field: str):
-      types = self.get_statistic_types(sql_session)
-      for type in types:
-          if field.startswith(type.source + '__'+type.key ):
-              return type
-      return None
+      return self.get_statistic_rollup(sql_session).type_for_field(field)
+
+  def get_statistic_rollup(self, sql_session):
+      if self.statistic_rollup is None:
+          self.statistic_rollup = StatisticRollup(self.get_statistic_types(sql_session), list(HOT_TRACKING_FIELDS.keys()))
+      return self.statistic_rollup
 
   def get_statistic_types(self, sql_session):
       if self.statistic_types is None:
@@ -60,6 +76,7 @@ class TrackingController():
   # Onboarding
   # #####################
   
+  @buffered_documents
   def add_ingest_update_artist(self, sql_session, spotify_id, user_id, org_id, tags = None):
     msg, status = self.add_artist(sql_session, spotify_id, user_id, org_id, None, tags)
     if status != 200:
@@ -69,64 +86,47 @@ class TrackingController():
   # def add_artist_sql(self, spotify_id, user_id, org_id):
 
   def set_tags(self, sql_session, organization_id, identifier, tags):
+      """
+      Make the organization's tags on an artist exactly tags. Other organizations' tags and
+      genre tags are left alone.
+      """
       sql_ref = artist_with_meta(sql_session=sql_session, artist_id=identifier)
-      final = list()
-      for tag in tags:
-          existing = pop_default(list(
-              filter(lambda x: x.tag == tag and x.organization_id == organization_id, sql_ref.tags)), None)
-          existing_self = pop_default(list(
-              filter(lambda x: x.tag == tag and x.organization_id == organization_id, final)), None)
-          if existing is not None or existing_self is not None:
-              continue
-          final.append(ArtistTag(
-              artist_id=sql_ref.id,
-              tag_type_id=1,
-              tag=tag,
-              organization_id=organization_id,
-          ))
-      for tag in sql_ref.tags:
-          existing = pop_default(list(
-              filter(lambda x: x == tag.tag and organization_id == tag.organization_id, tags)), None)
-          if existing is None:
-              sql_session.delete(tag)
-      sql_session.add_all(final)
-      sql_session.commit()
+      reconciliation = diff_by_key(
+          [{'artist_id': sql_ref.id, 'tag_type_id': 1, 'tag': tag, 'organization_id': organization_id} for tag in tags],
+          [tag for tag in sql_ref.tags if tag.organization_id == organization_id],
+          key=lambda x: x.tag,
+          desired_key=lambda x: x['tag'],
+      )
+      if apply_reconciliation(sql_session, ArtistTag, reconciliation):
+          sql_session.expire(sql_ref, ['tags'])
       return True
 
-  def add_tags(self, sql_session, sql_ref: Artist, organization_id, tags):
-      any = False
-      for tag in tags:
-          found = False
-          for old_tag in sql_ref.tags:
-              if old_tag.tag == tag and (old_tag.organization_id == organization_id or old_tag.organization_id is None):
-                  found = True
-          if found:
-              continue
-          any = True
-          sql_ref.tags.append(ArtistTag(
-              tag_type_id=1,
-              tag=tag,
-              organization_id=organization_id,
-          ))
-      if any:
-        sql_session.add(sql_ref)
-        sql_session.commit()
+  def add_tags(self, sql_session, sql_ref: Artist, organization_id, tags, commit=True):
+      # tags shared by every organization (organization_id None) count as already added
+      reconciliation = diff_by_key(
+          [{'artist_id': sql_ref.id, 'tag_type_id': 1, 'tag': tag, 'organization_id': organization_id} for tag in tags],
+          [tag for tag in sql_ref.tags if tag.organization_id == organization_id or tag.organization_id is None],
+          key=lambda x: x.tag,
+          desired_key=lambda x: x['tag'],
+          delete_missing=False,
+      )
+      if apply_reconciliation(sql_session, ArtistTag, reconciliation, commit):
+          sql_session.expire(sql_ref, ['tags'])
 
-  def add_genre_tags(self, sql_session, sql_ref: Artist, genres: list, tag_type_id: int):
+  def add_genre_tags(self, sql_session, sql_ref: Artist, genres: list, tag_type_id: int, commit=True):
       if not genres:
           return
-      for genre in genres:
-          exists = any(t.tag == genre and t.tag_type_id == tag_type_id for t in sql_ref.tags)
-          if exists:
-              continue
-          sql_ref.tags.append(ArtistTag(
-              tag_type_id=tag_type_id,
-              tag=genre,
-              organization_id=None,
-          ))
-      sql_session.add(sql_ref)
-      sql_session.commit()
+      reconciliation = diff_by_key(
+          [{'artist_id': sql_ref.id, 'tag_type_id': tag_type_id, 'tag': genre, 'organization_id': None} for genre in genres],
+          sql_ref.tags,
+          key=lambda x: (x.tag, x.tag_type_id),
+          desired_key=lambda x: (x['tag'], x['tag_type_id']),
+          delete_missing=False,
+      )
+      if apply_reconciliation(sql_session, ArtistTag, reconciliation, commit):
+          sql_session.expire(sql_ref, ['tags'])
 
+  @buffered_documents
   def add_artist(self, sql_session, spotify_id, user_id, org_id, sql_playlist_id = None, tags = None, import_id = None):
     try:
         if tags is None:
@@ -148,7 +148,7 @@ class TrackingController():
             organization_id=org_id,
             playlist_id=sql_playlist_id,
         )
-        doc = ref.get()
+        doc = self.documents.get(ref)
         # if artist exists add the user/org to tracking
         if doc.exists:
 
@@ -168,7 +168,7 @@ class TrackingController():
               "found_on": datetime.now().strftime("%Y-%m-%d")
             }
 
-          ref.update({
+          self.documents.update(ref, {
               "watching": data['watching'],
               "watching_details": data['watching_details'],
               "found_by_first": data['found_by_first'],
@@ -205,12 +205,12 @@ class TrackingController():
               sql_session.add(sqlRef)
               sql_session.add(attribution)
               sql_session.commit()
-          self.add_tags(sql_session, sqlRef, org_id, tags)
+          self.add_tags(sql_session, sqlRef, org_id, tags, commit=False)
 
           if import_id is not None:
               sql_session.execute(text('UPDATE import_artists SET status=2, artist_id=:artist_id, updated_at=NOW() WHERE import_id=:import_id AND spotify_id=:spotify_id'), {'artist_id': str(sqlRef.id), 'import_id': import_id, 'spotify_id': str(spotify_id)})
               sql_session.execute(text('UPDATE imports SET status=:status, completed_at=NOW(), updated_at=NOW() WHERE id=:import_id AND id NOT IN (SELECT import_id FROM import_artists WHERE status=0)'), {'status': 'complete', 'import_id': import_id})
-              sql_session.commit()
+          sql_session.commit()
 
 
           return 'Artist exists, added to tracking', 200
@@ -272,18 +272,19 @@ class TrackingController():
 
         for s in HOT_TRACKING_FIELDS:
           new_schema[f"stat_{s}__{HOT_TRACKING_FIELDS[s]}"] = []
-        ref.set(new_schema)
-        imported, skipped, avg, fails = self.import_sql(sql_session, ref.get(), attribution)
+        self.documents.set(ref, new_schema)
+        imported, skipped, avg, fails = self.import_sql(sql_session, self.documents.get(ref), attribution)
         if len(fails) > 0:
             print(str(fails))
             return 'Artist failed to import, please try again', 500
         artist_ref = artist_with_meta(sql_session, spotify_id)
-        self.add_tags(sql_session, artist_ref, org_id, tags)
-        self.add_genre_tags(sql_session, artist_ref, artist.get('genres', []), tag_type_id=3)
+        # tags, genres and the import status go in one commit
+        self.add_tags(sql_session, artist_ref, org_id, tags, commit=False)
+        self.add_genre_tags(sql_session, artist_ref, artist.get('genres', []), tag_type_id=3, commit=False)
         if import_id is not None:
             sql_session.execute(text('UPDATE import_artists SET status=2, artist_id=:artist_id, updated_at=NOW() WHERE import_id=:import_id AND spotify_id=:spotify_id'), {'artist_id': str(artist_ref.id), 'import_id': import_id, 'spotify_id': str(spotify_id)})
             sql_session.execute(text('UPDATE imports SET status=:status, completed_at=NOW(), updated_at=NOW() WHERE id=:import_id AND id NOT IN (SELECT import_id FROM import_artists WHERE status=0) AND completed_at IS NULL'), {'status': 'complete', 'import_id': import_id})
-            sql_session.commit()
+        sql_session.commit()
     except Exception as e:
         print(e)
         print(traceback.format_exc())
@@ -293,10 +294,11 @@ class TrackingController():
             sql_session.commit()
     return 'success', 200
   
+  @buffered_documents
   def ingest_artist(self, sql_session, spotify_id : str):
 
     ref = self.db.collection("artists_v2").document(spotify_id)
-    doc = ref.get()
+    doc = self.documents.get(ref)
     print("[INGEST] has doc")
     # check the artist exists
     if not doc.exists:
@@ -315,32 +317,36 @@ class TrackingController():
     try:
       info = self.songstats.get_artist_info(spotify_id)
     except ErrorResponse as e:
+      # don't come back before a negatively cached not-ingested response has expired
+      retry_at = self.songstats.retry_after(spotify_id) or datetime.now() + timedelta(minutes=10)
       # Artist didn't exist in songstats, need to requeue
       if e.status_code == 300:
-          ref.update({
+          self.documents.update(ref, {
             "ob_status": "waiting_ingest",
-            "ob_wait_till": datetime.now() + timedelta(minutes=10)
+            "ob_wait_till": retry_at
           })
           sql_ref.onboard_failure = 300
           sql_session.add_all([sql_ref])
           sql_session.commit()
           return 'Waiting for data', 201
       if e.status_code == 404:
-          ref.update({
+          self.documents.update(ref, {
             "ob_status": "waiting_ingest",
-            "ob_wait_till": datetime.now() + timedelta(minutes=10)
+            "ob_wait_till": retry_at
           })
-          self.set_onboard_wait(sql_session, sql_ref, e.status_code, datetime.now() + timedelta(minutes=10))
+          self.set_onboard_wait(sql_session, sql_ref, e.status_code, retry_at)
           return 'Waiting for data', 201
       elif e.status_code == 302:
-          ref.update({
+          self.documents.update(ref, {
             "ob_status": "waiting_ingest",
-            "ob_wait_till": datetime.now() + timedelta(minutes=10)
+            "ob_wait_till": retry_at
           })
-          self.set_onboard_wait(sql_session, sql_ref, e.status_code, datetime.now() + timedelta(minutes=10))
+          self.set_onboard_wait(sql_session, sql_ref, e.status_code, retry_at)
           return 'Waiting for data', 201
+      elif e.status_code == BREAKER_OPEN_STATUS:
+          return self.wait_for_songstats(sql_session, sql_ref)
       elif e.status_code == 429:
-          ref.update({
+          self.documents.update(ref, {
             "ob_status": "waiting_ingest",
             "ob_wait_till": datetime.now() + timedelta(days=30)
           })
@@ -355,7 +361,7 @@ class TrackingController():
     print("[INGEST] has info")
     print(str(info))
     # add the additional info
-    ref.update({
+    self.documents.update(ref, {
       "avatar": info['artist_info']['avatar'],
       "links": info['artist_info']['links'],
     })
@@ -364,7 +370,7 @@ class TrackingController():
     # get the stats now that we know the artist is in SS
     self.update_artist(sql_session, spotify_id, is_ob=True)
 
-    ref.update({
+    self.documents.update(ref, {
       "ob_status": "onboarded"
     })
 
@@ -372,6 +378,20 @@ class TrackingController():
 
     return 'success', 200
 
+  def wait_for_songstats(self, sql_session, sql_ref):
+      """
+      Songstats' circuit breaker is open: pick the artist up again once it closes, without
+      touching its onboarding status or failure code.
+      """
+      retry_at = self.songstats.breaker.status().get('open_until')
+      retry_at = retry_at.astimezone().replace(tzinfo=None) if retry_at is not None else datetime.now() + timedelta(minutes=5)
+      sql_ref.stats_queued_at = None
+      if not sql_ref.onboarded:
+          sql_ref.onboard_wait_until = retry_at
+      sql_session.add_all([sql_ref])
+      sql_session.commit()
+      return 'Songstats unavailable, retrying later', 201
+
   def set_onboard_wait(self, sql_session, sql_ref, code, onboard_wait = None):
       sql_ref.onboard_wait_until = onboard_wait
       sql_ref.stats_queued_at = None
@@ -382,7 +402,8 @@ class TrackingController():
   # Stats
   # #####################
   
-  def update_artist(self, sql_session, spotify_id : str = None, artist_id: str = None, is_ob=False):
+  @buffered_documents
+  def update_artist(self, sql_session, spotify_id : str = None, artist_id: str = None, is_ob=False, incremental=True):
     sql_ref = None
     if spotify_id is None:
       sql_ref = artist_with_meta(sql_session, None, artist_id)
@@ -391,7 +412,7 @@ class TrackingController():
       spotify_id = sql_ref.spotify_id
     print("Updating artist: " + str(spotify_id))
     ref = self.db.collection("artists_v2").document(spotify_id)
-    doc = ref.get()
+    doc = self.documents.get(ref)
 
     # check the artist exists
     if not doc.exists:
@@ -410,20 +431,24 @@ class TrackingController():
     #   raise ErrorResponse('Artist not ingested', 401, 'Tracking')
     try:
     #   stats = self.songstats.get_stat_weeks_abs(spotify_id, 8)
-      stats = self.songstats.get_stat_days_abs(spotify_id, 8 * 7)
+      stats = self.get_artist_daily_stats(sql_session, sql_ref, doc, 8 * 7) if incremental else None
+      if stats is None:
+        stats = self.songstats.get_stat_days_abs(spotify_id, 8 * 7)
     #   print(spotify_id, str(stats))
     except ErrorResponse as e:
       # Artist somehow got removed from songstats, but them back in OB
       if e.status_code == 404:
-          ref.update({
+          self.documents.update(ref, {
             "ob_status": "waiting_ingest",
             "ob_wait_till": datetime.now() + timedelta(minutes=10)
           })
           self.set_onboard_wait(sql_session, sql_ref, 404, datetime.now() + timedelta(minutes=10))
 
           return 'Waiting for data', 201
+      elif e.status_code == BREAKER_OPEN_STATUS:
+          return self.wait_for_songstats(sql_session, sql_ref)
       elif e.status_code == 429:
-          ref.update({
+          self.documents.update(ref, {
             "ob_status": "waiting_ingest",
             "ob_wait_till": datetime.now() + timedelta(days=30)
           })
@@ -436,38 +461,20 @@ class TrackingController():
 
     try:
         #  update the hot tracking stats on the artist
-        update = {"stat_dates": stats['as_of'], "stats_as_of": datetime.now()}
-        allNewStats = True
-        for s in HOT_TRACKING_FIELDS:
-          sql_statistic_type = self.get_statistic_type_from_field(sql_session, s)
-          values = stats['stats'][s] if s in stats['stats'] else []
-          if values is None or len(values) == 0:
-              if sql_statistic_type.id == 30:
-                  values = stats['stats']["spotify__monthly_listeners_current"] if "spotify__monthly_listeners_current" in stats['stats'] else []
-          update[f"stat_{s}__{HOT_TRACKING_FIELDS[s]}"] = values
-          if len(stats['as_of']) > 0:
-              wasUpdate = self.add_or_update_sql_stat(sql_ref, sql_statistic_type, stats['as_of'].pop(), values)
-          # if wasUpdate:
-          #     allNewStats = False
+        writer = StatisticsWriter()
+        update, archive = self.queue_stat_update(sql_session, sql_ref, stats, writer)
+        # every hot stat rolled up together and upserted in a single statement
+        writer.flush(sql_session)
 
         self.update_sql_meta(sql_session, sql_ref, doc)
-        ref.update(update)
-        if len(sql_ref.attributions) > 0 and self.twilio is not None:
-            user_ids = []
-            for attr in sql_ref.attributions:
-                if attr.notified:
-                    continue
-                if attr.playlist_id is not None:
-                    continue
-
-                if attr.user_id not in user_ids:
-                    user_ids.append(attr.user_id)
-            if len(user_ids) > 0:
-                users = self.db.collection('users').where(filter=FieldFilter(
-        "id", "array_contains_any", user_ids
-                )).where(filter=FieldFilter("sms.verified", "==", True)).get()
-                for user in users:
-                    self.twilio.send_artist_stats(user.to_dict(), sql_ref, True)
+        try:
+            archive_statistics(sql_session, archive)
+        except Exception as e:
+            # the archive is a side record, a failed write shouldn't fail the refresh
+            sql_session.rollback()
+            print("Statistic archive write failed: " + str(e))
+        self.documents.update(ref, update)
+        self.notify_attributions(sql_ref)
 
 
     except Exception as e:
@@ -480,82 +487,216 @@ class TrackingController():
     # TODO Add the deep stats subcollection
     return 'success', 200
 
-  def update_sql_meta(self, sql_session, sql_ref, doc):
+  @buffered_documents
+  def update_artists(self, sql_session, artist_ids: list, task_controller = None, incremental=True):
+    """
+    Stats refresh for a batch of artists: one query for their SQL rows, one read for their
+    Firestore docs, songstats fetched concurrently and everything written back in one transaction.
+    Artists that can't be done in the batch (missing rows, songstats errors) are requeued to
+    /update-artist, which handles their waits and retries.
+    """
+    artists = artists_with_meta(sql_session, artist_ids)
+    refs = [self.db.collection("artists_v2").document(artist.spotify_id) for artist in artists]
+    docs = {doc.id: doc for doc in self.documents.get_all(refs)}
+    found_ids = set(str(artist.id) for artist in artists)
+    requeue = [str(artist_id) for artist_id in artist_ids if str(artist_id) not in found_ids]
+    items = []
+    for artist in artists:
+      doc = docs.get(artist.spotify_id)
+      if doc is None or not doc.exists:
+        requeue.append(str(artist.id))
+      else:
+        items.append((artist, doc))
+
+    # warm the type lookups here, the fetch threads must not touch the session
+    self.get_statistic_rollup(sql_session)
+
+    def fetch(item):
+      sql_ref, doc = item
+      stats = self.get_artist_daily_stats(sql_session, sql_ref, doc, 8 * 7) if incremental else None
+      if stats is None:
+        stats = self.songstats.get_stat_days_abs(sql_ref.spotify_id, 8 * 7)
+      return stats
+
+    results = map_concurrently(fetch, items, STATS_FETCH_WORKERS, return_exceptions=True)
+
+    writer = StatisticsWriter()
+    updates = []
+    archive = []
+    deferred = []
+    for (sql_ref, doc), stats in zip(items, results):
+      if isinstance(stats, ErrorResponse) and stats.status_code == BREAKER_OPEN_STATUS:
+        # requeueing would only fail again; the stats cron picks these up once the breaker closes
+        deferred.append(sql_ref.id)
+        continue
+      if isinstance(stats, Exception):
+        print(f"Stats fetch failed for {sql_ref.spotify_id}, requeueing: {stats}")
+        requeue.append(str(sql_ref.id))
+        continue
+      try:
+        update, rows = self.queue_stat_update(sql_session, sql_ref, stats, writer)
+      except Exception as e:
+        print(f"Stats rollup failed for {sql_ref.spotify_id}, requeueing: {e}")
+        requeue.append(str(sql_ref.id))
+        continue
+      updates.append((sql_ref, doc, update))
+      archive.extend(rows)
+
+    try:
+      writer.flush(sql_session)
+      for sql_ref, doc, update in updates:
+        self.update_sql_meta(sql_session, sql_ref, doc, commit=False)
+      sql_session.commit()
+    except Exception as e:
+      sql_session.rollback()
+      print(traceback.format_exc())
+      print("Batch stats write failed, requeueing the batch: " + str(e))
+      requeue.extend(str(sql_ref.id) for sql_ref, _, _ in updates)
+      updates = []
+
+    if len(updates) > 0:
+      try:
+        archive_statistics(sql_session, archive)
+      except Exception as e:
+        sql_session.rollback()
+        print("Statistic archive write failed: " + str(e))
+      for sql_ref, doc, update in updates:
+        self.documents.update(doc.reference, update)
+      self.documents.flush()
+      for sql_ref, _, _ in updates:
+        try:
+          self.notify_attributions(sql_ref)
+        except Exception as e:
+          print(f"Stats notification failed for {sql_ref.spotify_id}: {e}")
+
+    if len(deferred) > 0:
+      print(f"Songstats circuit breaker open, deferring {len(deferred)} artists")
+      sql_session.query(Artist).filter(Artist.id.in_(deferred)).update({Artist.stats_queued_at: None}, synchronize_session=False)
+      sql_session.commit()
+
+    if task_controller is not None:
+      for artist_id in requeue:
+        task_controller.enqueue_task('StatsQueue', 2, '/update-artist', {"id": artist_id})
+    print(f"Artists updated: {len(updates)}, requeued: {len(requeue)}, deferred: {len(deferred)}")
+    return {'updated': len(updates), 'requeued': len(requeue), 'deferred': len(deferred)}, 200
+
+  def queue_stat_update(self, sql_session, sql_ref, stats, writer: StatisticsWriter):
+      """
+      Queue the artist's hot stats on writer. Returns the artists_v2 doc update and the archive rows.
+      """
+      update = {"stat_dates": stats['as_of'], "stats_as_of": datetime.now()}
+      archive = []
+      series = {}
+      for s in HOT_TRACKING_FIELDS:
+          sql_statistic_type = self.get_statistic_type_from_field(sql_session, s)
+          values = []
+          for column in self.hot_field_columns(sql_statistic_type, s):
+              if stats['stats'].get(column):
+                  values = stats['stats'][column]
+                  break
+          update[f"stat_{s}__{HOT_TRACKING_FIELDS[s]}"] = values
+          series[sql_statistic_type.id] = values
+          if len(values) == len(stats['as_of']):
+              archive.extend(archive_rows(sql_ref.id, sql_statistic_type.id, stats['as_of'], values))
+      if len(stats['as_of']) > 0:
+          writer.add(sql_ref.id, self.get_statistic_rollup(sql_session).compute(series), stats['as_of'][-1])
+      return update, archive
+
+  def notify_attributions(self, sql_ref):
+      if len(sql_ref.attributions) > 0 and self.twilio is not None:
+          user_ids = []
+          for attr in sql_ref.attributions:
+              if attr.notified:
+                  continue
+              if attr.playlist_id is not None:
+                  continue
+
+              if attr.user_id not in user_ids:
+                  user_ids.append(attr.user_id)
+          if len(user_ids) > 0:
+              users = self.db.collection('users').where(filter=FieldFilter(
+      "id", "array_contains_any", user_ids
+              )).where(filter=FieldFilter("sms.verified", "==", True)).get()
+              for user in users:
+                  self.twilio.send_artist_stats(user.to_dict(), sql_ref, True)
+
+  def rebuild_stats_from_archive(self, sql_session, artist_id: str, days: int = 8 * 7):
+      """
+      Recompute the artist's Statistic rows from the archive, without calling songstats.
+      """
+      sql_ref = artist_with_meta(sql_session, None, artist_id)
+      if sql_ref is None:
+          raise ErrorResponse('Artist not found: ' + str(artist_id), 404, 'Tracking')
+      rollup = self.get_statistic_rollup(sql_session)
+      series = load_archived_series(sql_session, sql_ref.id, days)
+      writer = StatisticsWriter()
+      # series can end on different days, so each is queued with its own last date
+      for statistic_type_id, (dates, values) in series.items():
+          writer.add(sql_ref.id, rollup.compute({statistic_type_id: values}), dates[-1])
+      return writer.flush(sql_session, commit=True)
+
+  def hot_field_columns(self, statistic_type: StatisticType, field: str):
+      # songstats reports spotify monthly listeners as a _current stat
+      if statistic_type is not None and statistic_type.id == 30:
+          return [field, "spotify__monthly_listeners_current"]
+      return [field]
+
+  def get_artist_daily_stats(self, sql_session, sql_ref, doc, days: int):
+      """
+      Daily stats for the hot tracking fields, fetching only the days since the stored series end.
+      Fields without a stored Statistic (no history on that source) are left out, as a full fetch would.
+      Returns None when there's nothing usable stored (or the new days leave a gap) and a full fetch is needed.
+      """
+      stats_by_type = {stat.statistic_type_id: stat for stat in sql_ref.statistics}
+      series = {}
+      columns = {}
+      absent = []
+      last_date = None
+      for s in HOT_TRACKING_FIELDS:
+          sql_statistic_type = self.get_statistic_type_from_field(sql_session, s)
+          stat = stats_by_type.get(sql_statistic_type.id) if sql_statistic_type is not None else None
+          if stat is None or stat.last_date is None or not stat.data:
+              absent.extend(self.hot_field_columns(sql_statistic_type, s))
+              continue
+          if last_date is not None and stat.last_date != last_date:
+              return None
+          last_date = stat.last_date
+          series[s] = stat.data
+          columns[s] = self.hot_field_columns(sql_statistic_type, s)
+      if last_date is None:
+          return None
+      if last_date.date() < datetime.now().date() - timedelta(days=days):
+          return None
+      lengths = set(len(values) for values in series.values())
+      if len(lengths) != 1:
+          return None
+      length = lengths.pop()
+      # the stored values only line up with days if the stored dates were consecutive
+      as_of = [(last_date - timedelta(days=length - 1 - i)).strftime('%Y-%m-%d') for i in range(length)]
+      if (doc.to_dict() or {}).get('stat_dates') != as_of:
+          return None
+      stats = self.songstats.get_stat_days_abs_since(sql_ref.spotify_id, days, {'stats': series, 'as_of': as_of}, columns, absent)
+      if stats is None:
+          print("Stored stats don't continue, doing a full fetch: " + str(sql_ref.spotify_id))
+      return stats
+
+  def update_sql_meta(self, sql_session, sql_ref, doc, commit=True):
       sql_ref.avatar = doc.get('avatar')
       sql_links = self.convert_links(sql_session, doc, sql_ref.id)
       if sql_ref.avatar is not None or len(sql_links) > 0:
           sql_ref.onboard_wait_until = None
-      final = list()
-      for link in sql_links:
-          existing = pop_default(list(
-              filter(lambda x: x.link_source_id == link.link_source_id and x.path == link.path, sql_ref.links)), None)
-          existing_self = pop_default(list(
-              filter(lambda x: x.link_source_id == link.link_source_id and x.path == link.path, final)), None)
-          if existing is not None or existing_self is not None:
-              continue
-          final.append(link)
-      for link in sql_ref.links:
-          existing = pop_default(list(
-              filter(lambda x: x.link_source_id == link.link_source_id and x.path == link.path, sql_links)), None)
-          if existing is None:
-              sql_session.delete(link)
       sql_ref.onboarded = doc.get("ob_status") == 'onboarded' or sql_ref.avatar is not None
-      sql_session.add_all(final)
       sql_session.add_all([sql_ref])
-      sql_session.commit()
-
-  def add_or_update_sql_stat(self, artist: Artist, statistic_type: StatisticType, date, values):
-      if len(values) == 0:
-          return False
-      if statistic_type.format == 'int':
-          valueSet = list(map(int, values))
-          latest: int = valueSet[len(valueSet) - 1]
-          previous_day: int = valueSet[len(valueSet) - 2]
-          previous_week: int = valueSet[len(valueSet) - 8]
-          previous_month: int = valueSet[len(valueSet) - 29]
-      else:
-          valueSet = list(map(float, values))
-          latest: float = valueSet[len(valueSet) - 1]
-          previous_day: float = valueSet[len(valueSet) - 2]
-          previous_week: float = valueSet[len(valueSet) - 8]
-          previous_month: float = valueSet[len(valueSet) - 29]
-      dod = 0 if previous_day <= 0 else (latest - previous_day) / previous_day
-      wow = 0 if previous_week <= 0 else (latest - previous_week) / previous_week
-      mom = 0 if previous_month <= 0 else (latest - previous_month) / previous_month
-      found_stat = None
-      for stat in artist.statistics:
-          if stat.statistic_type_id == statistic_type.id:
-              stat.latest = latest
-              stat.previous = previous_week
-              stat.max = max(valueSet)
-              stat.min = min(valueSet)
-              stat.avg = sum(valueSet) / len(valueSet)
-              stat.data = valueSet
-              stat.day_over_day = dod
-              stat.week_over_week = wow
-              stat.month_over_month = mom
-              stat.last_date = date
-              stat.updated_at = datetime.now()
-              found_stat = stat
-              return True
-
-      if found_stat is None:
-          found_stat = Statistic(
-              type=statistic_type,
-              latest=latest,
-              previous=previous_week,
-              max=max(valueSet),
-              min=min(valueSet),
-              avg=sum(valueSet) / len(valueSet),
-              data=valueSet,
-              day_over_day=dod,
-              week_over_week=wow,
-              month_over_month=mom,
-              last_date=date,
-          )
-          artist.statistics.append(found_stat)
-          return False
-
+      reconciliation = diff_by_key(
+          [{'artist_id': sql_ref.id, 'link_source_id': link.link_source_id, 'path': link.path} for link in sql_links],
+          sql_ref.links,
+          key=lambda x: (x.link_source_id, x.path),
+          desired_key=lambda x: (x['link_source_id'], x['path']),
+      )
+      if apply_reconciliation(sql_session, ArtistLink, reconciliation, commit=False):
+          sql_session.expire(sql_ref, ['links'])
+      if commit:
+          sql_session.commit()
 
   # ######################
   # Cron Support
@@ -606,36 +747,16 @@ class TrackingController():
             sql_ids.append(id)
     return list(sql_ids)
 
-  def convert_artist_link(self, link, sources, artist_id = None):
+  def convert_artist_link(self, link, normalizer: LinkNormalizer, artist_id = None):
 
-      filtered_sources = list(filter(lambda s: s.key == link.get('source'), sources))
-
-      if len(filtered_sources) == 0:
-          print(f"No valid source: '{link.get('source')}' for url '{link.get('url')}' — skipping link. Known sources: {[s.key for s in sources]}")
+      parsed = normalizer.parse(link.get('source'), link.get('url'))
+      if parsed is None:
+          print(f"No valid source: '{link.get('source')}' for url '{link.get('url')}' — skipping link. Known sources: {list(normalizer.sources.keys())}")
           return None
 
-      url: str = link.get('url')
-      source: LinkSource = filtered_sources[0]
-      if source.key == 'twitter' and 'x.com' in url:
-          source = list(filter(lambda s: s.key == 'x', sources))[0]
-
-      source_parts = source.url_scheme.split('{identifier}')
-      scheme_part_one = (source_parts[0]
-                         .replace('https://', '')
-                         .replace('http://', '')
-                         .replace('www.', ''))
-      scheme_part_two = source_parts[1]
-
-      url_identifier = (link.get("url")
-                        .replace('https://', '')
-                        .replace('http://', '')
-                        .replace('www.', '')
-                        .replace(scheme_part_one, ''))
-      if len(scheme_part_two) > 0:
-          url_identifier = url_identifier.split(scheme_part_two)[0]
-      url_identifier = url_identifier.split("?")[0]
+      link_source_id, url_identifier = parsed
       artist_link = ArtistLink(
-         link_source_id=source.id,
+         link_source_id=link_source_id,
          path=url_identifier,
       )
       if artist_id is not None:
@@ -679,18 +800,48 @@ class TrackingController():
     else:
         return None
     return eval
+  def import_added_by(self, artist, userOrgs, orgId, watchDetails):
+      added_by = watchDetails.get('added_by', None)
+      if added_by is None:
+          for user_id, found_details in artist.get('found_by_details').items():
+                if userOrgs[user_id] == orgId or found_details.get('found_on') == watchDetails.get('added_on'):
+                    added_by = user_id
+      return added_by
+
+  def import_stat_type(self, sql_session, stat_types, keyStr: str):
+      """
+      StatisticType for a firestore stat_ field, created (and committed) if it doesn't exist yet.
+      """
+      statSource = keyStr.split('_')[1].split('__')[0]
+      statName = keyStr.split('__')[1]
+      if statName == 'monthly_listeners_current':
+          statName = 'monthly_listeners'
+      for statType in stat_types:
+          if statType.source == statSource and statType.key == statName:
+              return statType
+
+      newStatType = StatisticType(
+          name=statName,
+          key=statName,
+          source=statSource,
+          format='int'
+      )
+      sql_session.add(newStatType)
+      sql_session.commit()
+      print("ADDING TYPE: " + statName)
+      stat_types.append(newStatType)
+      return newStatType
+
   def import_sql(self, sql_session, old_artists, attribution = None, tags = None):
 
       if not isinstance(old_artists, QueryResultsList):
           old_artists = [old_artists]
       stat_types = list(sql_session.scalars(select(StatisticType)).all())
-      userOrgs = dict()
-      if self.users is None:
-        self.users = self.db.collection('users').get()
-      for user in self.users:
-          id = user.id
-          user = user.to_dict()
-          userOrgs[id] = user.get('organization')
+      # only the users these artists were found by are looked up
+      user_ids = set()
+      for artist in old_artists:
+          user_ids.update(((artist.to_dict() or {}).get('found_by_details') or {}).keys())
+      userOrgs = user_directory(self.db).organizations_for(list(user_ids))
 
       spotifys = list(map(lambda x: x.get('spotify_id'), old_artists))
       existing = sql_session.scalars(select(Artist).where(Artist.spotify_id.in_(spotifys))).all()
@@ -712,12 +863,7 @@ class TrackingController():
               try:
                   orgs = list()
                   for orgId, watchDetails in artist.get('watching_details').items():
-                      added_by = watchDetails.get('added_by', None)
-                      if added_by is None:
-                          for user_id, found_details in artist.get('found_by_details').items():
-                                if userOrgs[user_id] == orgId or found_details.get('found_on') == watchDetails.get('added_on'):
-                                    added_by = user_id
-
+                      added_by = self.import_added_by(artist, userOrgs, orgId, watchDetails)
                       orgs.append(OrganizationArtist(
                           organization_id=orgId,
                           added_by=added_by,
@@ -735,27 +881,7 @@ class TrackingController():
                           continue
                       if keyStr == 'stat_dates':
                           continue
-                      statSource = keyStr.split('_')[1].split('__')[0]
-                      statName = keyStr.split('__')[1]
-                      if statName == 'monthly_listeners_current':
-                          statName = 'monthly_listeners'
-                      newStatType = None
-                      for statType in stat_types:
-                          if statType.source == statSource and statType.key == statName:
-                              newStatType = statType
-                              break
-
-                      if newStatType == None:
-                          newStatType = StatisticType(
-                              name=statName,
-                              key=statName,
-                              source=statSource,
-                              format='int'
-                          )
-                          sql_session.add(newStatType)
-                          sql_session.commit()
-                          print("ADDING TYPE: " + statName)
-                          stat_types.append(newStatType)
+                      newStatType = self.import_stat_type(sql_session, stat_types, keyStr)
 
                       if len(value) == 0:
                           continue
@@ -840,12 +966,153 @@ class TrackingController():
         avg = (end-start) / imported
       return imported, skipped, avg, fails
 
+  def import_sql_bulk(self, sql_session, old_artists, attribution = None):
+      """
+      import_sql for a whole page at once: rows are staged per table and written in one transaction
+      (see ArtistImportBatch), existing artists are skipped by the insert itself.
+
+      If the page can't be written as a whole it falls back to import_sql per artist, so one bad
+      artist doesn't fail the page.
+      """
+      if not isinstance(old_artists, (list, QueryResultsList)):
+          old_artists = [old_artists]
+      start = time.time()
+      stat_types = list(sql_session.scalars(select(StatisticType)).all())
+      normalizer = link_normalizer(sql_session)
+      user_ids = set()
+      for artist in old_artists:
+          user_ids.update(((artist.to_dict() or {}).get('found_by_details') or {}).keys())
+      userOrgs = user_directory(self.db).organizations_for(list(user_ids))
+
+      spotifys = list(map(lambda x: x.get('spotify_id'), old_artists))
+      existing = set(sql_session.scalars(select(Artist.spotify_id).where(Artist.spotify_id.in_(spotifys))).all())
+      batch = ArtistImportBatch()
+      staged_docs = {}
+      skipped = 0
+      fails = {}
+      for artist in old_artists:
+          spotify_id = artist.get('spotify_id')
+          if spotify_id in existing or spotify_id in staged_docs:
+              skipped += 1
+              continue
+          try:
+              self.stage_import(sql_session, batch, artist, stat_types, normalizer, userOrgs, attribution)
+              staged_docs[spotify_id] = artist
+          except Exception as e:
+              traceback.print_exc()
+              fails[spotify_id] = repr(e)
+
+      imported = 0
+      try:
+          inserted, conflicts = batch.flush(sql_session)
+          imported = len(inserted)
+          skipped += len(conflicts)
+      except Exception as e:
+          print(f"Bulk import of {len(staged_docs)} artists failed, importing one by one: {e!r}")
+          for spotify_id, artist in staged_docs.items():
+              added, existed, _, artist_fails = self.import_sql(sql_session, artist, attribution)
+              imported += added
+              skipped += existed
+              fails.update(artist_fails)
+
+      if len(fails) > 0:
+          print(str(fails))
+      sql_session.close()
+      end = time.time()
+      avg = 0
+      if imported > 0:
+        avg = (end-start) / imported
+      return imported, skipped, avg, fails
+
+  def stage_import(self, sql_session, batch: ArtistImportBatch, artist, stat_types, normalizer: LinkNormalizer, userOrgs, attribution = None):
+      """
+      Stage the rows import_sql would create for a firestore artist into batch.
+      """
+      eval = self.convert_eval(artist)
+      if eval is None:
+          raise ValueError("artist has no evaluation")
+      evaluation = {
+          'distributor': eval.distributor,
+          'distributor_type': eval.distributor_type,
+          'label': eval.label,
+          'status': eval.status,
+          'back_catalog': eval.back_catalog,
+      }
+      if eval.created_at is not None:
+          evaluation['created_at'] = eval.created_at
+
+      orgs = list()
+      orgId = None
+      for orgId, watchDetails in artist.get('watching_details').items():
+          added_by = self.import_added_by(artist, userOrgs, orgId, watchDetails)
+          # checked here so a bad artist fails on its own rather than failing the page's insert
+          if added_by is None:
+              raise ValueError(f"no user added the artist to {orgId}")
+          orgs.append({
+              'organization_id': orgId,
+              'added_by': added_by,
+              'muted': False,
+              'last_playlist_id': attribution.playlist_id if attribution is not None else None,
+              'created_at': watchDetails.get('added_on'),
+          })
+
+      series = {}
+      for key, value in artist.to_dict().items():
+          if not key.startswith('stat_') or key == 'stat_dates':
+              continue
+          statType = self.import_stat_type(sql_session, stat_types, key)
+          if len(value) < 29:
+              continue
+          series[statType.id] = value
+      stat_dates = artist.get('stat_dates')
+      stats = list()
+      now = datetime.now()
+      for statistic_type_id, metrics in StatisticRollup(stat_types, []).compute(series).items():
+          stats.append(dict(metrics, statistic_type_id=statistic_type_id, last_date=stat_dates[len(stat_dates) - 1],
+                            created_at=now, updated_at=now))
+
+      userArtists = list()
+      for user_id, found_details in artist.get('found_by_details').items():
+          if userOrgs[user_id] is None:
+              raise ValueError(f"user {user_id} has no organization")
+          userArtists.append({
+              'user_id': user_id,
+              'organization_id': userOrgs[user_id],
+              'created_at': found_details.get('found_on'),
+          })
+
+      links = list()
+      for link in (artist.to_dict().get('links') or []):
+          artist_link = self.convert_artist_link(link, normalizer)
+          if artist_link is None:
+              continue
+          row = {'link_source_id': artist_link.link_source_id, 'path': artist_link.path}
+          if row not in links:
+              links.append(row)
+
+      attributions_list = list()
+      if attribution is not None:
+          attributions_list.append({
+              'user_id': attribution.user_id,
+              'organization_id': orgId,
+              'playlist_id': attribution.playlist_id,
+              'created_at': now,
+              'notified': False,
+          })
+
+      batch.add({
+          'spotify_id': artist.get('spotify_id'),
+          'name': artist.get('name'),
+          'avatar': artist.get('avatar'),
+          'onboarded': artist.get("ob_status") == 'onboarded' or artist.get('avatar') is not None,
+      }, evaluation, orgs, userArtists, stats, links, attributions_list)
+
   def convert_links(self, sql_session, artist, sql_id = None):
-      link_sources = sql_session.scalars(select(LinkSource)).all()
       links = list()
       dict_artist = artist.to_dict()
       if 'links' in dict_artist:
-          links = list(filter(None, map(lambda x: self.convert_artist_link(x, link_sources, sql_id), dict_artist.get('links', []))))
+          normalizer = link_normalizer(sql_session, [link.get('source') for link in dict_artist.get('links', [])])
+          links = list(filter(None, map(lambda x: self.convert_artist_link(x, normalizer, sql_id), dict_artist.get('links', []))))
 
           filtered_links = list()
           for link in links:
@@ -6,6 +6,8 @@ from sqlalchemy import bindparam, update
 from controllers import AirtableV1Controller, TaskController, TrackingController, EvalController
 from lib import Artist
 
+# artists per /update-artists task
+STATS_BATCH_SIZE = 25
 
 # def ob_eval_cron(task_controller : TaskController, tracking_controller: TrackingController, batch_size : int):
 #    artist_ids = tracking_controller.find_needs_ob_eval(batch_size)
@@ -14,6 +16,9 @@ from lib import Artist
 #         task_controller.enqueue_task('EvalQueue', 2, '/eval-artist', body)
 
 def onboarding_cron(sql_session, task_controller : TaskController, tracking_controller: TrackingController, batch_size : int):
+   if tracking_controller.songstats.breaker.is_open():
+       print("Songstats circuit breaker open, skipping onboarding dispatch")
+       return
    artist_ids = tracking_controller.find_needs_ob_ingest(sql_session, batch_size)
    if len(artist_ids) == 0:
        print("No artists need onboarding ingest")
@@ -55,6 +60,9 @@ def eval_cron(sql_session, task_controller : TaskController, eval_controller: Ev
 
 
 def stats_cron(sql_session, task_controller : TaskController, tracking_controller: TrackingController, batch_size : int, bulk_update):
+    if tracking_controller.songstats.breaker.is_open():
+        print("Songstats circuit breaker open, skipping stats dispatch")
+        return
     artist_ids = tracking_controller.find_needs_stats_refresh(sql_session, batch_size)
     artist_id_strs = []
     if len(artist_ids) == 0:
@@ -64,8 +72,9 @@ def stats_cron(sql_session, task_controller : TaskController, tracking_controlle
         print(f"queueing stats for {len(artist_ids)} artists")
     for artist_id in artist_ids:
         artist_id_strs.append(str(artist_id))
-        body = {"id": str(artist_id)}
-        task_controller.enqueue_task('StatsQueue', 2, '/update-artist', body)
+    for i in range(0, len(artist_id_strs), STATS_BATCH_SIZE):
+        body = {"ids": artist_id_strs[i:i + STATS_BATCH_SIZE]}
+        task_controller.enqueue_task('StatsQueue', 2, '/update-artists', body)
 
     bulk_update(sql_session, artist_id_strs, 'stats_queued_at = NOW()')
 
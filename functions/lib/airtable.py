@@ -1,6 +1,6 @@
-import requests
 import json
 from .errors import ErrorResponse
+from .http_sessions import session_for
 
 
 class AirtableClient():
@@ -11,7 +11,7 @@ class AirtableClient():
     self.tables = tables
 
   def get(self, path, data=None):
-    res = requests.get(f"{self.root_uri}{path}", headers= {
+    res = session_for(self.root_uri).get(f"{self.root_uri}{path}", headers= {
       "Authorization": f"Bearer {self.token}",
       "Content-Type": "application/json"
     },
@@ -23,7 +23,7 @@ class AirtableClient():
     return res.json()
 
   def post(self, path, data=None):
-    res = requests.post(f"{self.root_uri}{path}", headers= {
+    res = session_for(self.root_uri).post(f"{self.root_uri}{path}", headers= {
       "Authorization": f"Bearer {self.token}",
       "Content-Type": "application/json"
     },
@@ -33,7 +33,7 @@ class AirtableClient():
     return res.json()
   
   def patch(self, path, data=None):
-    res = requests.patch(f"{self.root_uri}{path}", headers= {
+    res = session_for(self.root_uri).patch(f"{self.root_uri}{path}", headers= {
       "Authorization": f"Bearer {self.token}",
       "Content-Type": "application/json"
     },
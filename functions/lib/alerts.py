@@ -1,7 +1,7 @@
-import requests
 import json
 import os
 from .errors import ErrorResponse
+from .http_sessions import session_for
 
 class SendblueClient():
   def __init__(self, key, secret):
@@ -15,7 +15,7 @@ class SendblueClient():
         "sb-api-secret-key": self.secret,
         "content-type": "application/json"
     }
-    res = requests.post(f"{self.root_uri}{path}", headers=headers,
+    res = session_for(self.root_uri).post(f"{self.root_uri}{path}", headers=headers,
     json=data)
     if res.status_code > 299:
       raise ErrorResponse(res.json(), res.status_code, "Airtable")
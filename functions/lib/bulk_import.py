@@ -0,0 +1,117 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import Artist, Evaluation, OrganizationArtist, UserArtist, Statistic, ArtistLink, Attribution
+
+# rows per INSERT statement; the widest table (statistics, 14 columns) stays far below postgres' bind limit
+BULK_INSERT_CHUNK = 1000
+
+# tables written after artists, in FK safe order, keyed by their staged row list
+CHILD_TABLES = [
+  ('organizations', OrganizationArtist),
+  ('users', UserArtist),
+  ('statistics', Statistic),
+  ('links', ArtistLink),
+  ('attributions', Attribution),
+]
+
+
+class ArtistImportBatch():
+  """
+  Rows for a page of Firestore artists, staged per table and written in a single transaction
+  with multi-row INSERT ... ON CONFLICT DO NOTHING instead of an ORM graph and commit per artist.
+
+  Artist ids are generated up front so child rows can reference them before anything is written.
+  Artists whose spotify_id already exists are skipped along with all of their child rows.
+  """
+  def __init__(self, chunk_size: int = BULK_INSERT_CHUNK):
+    self.chunk_size = chunk_size
+    self.staged = {}
+
+  def __len__(self):
+    return len(self.staged)
+
+  def add(self, artist: dict, evaluation: dict, organizations: list = (), users: list = (), statistics: list = (),
+          links: list = (), attributions: list = ()):
+    """
+    Stage an artist. Rows are plain column dicts without artist_id, which is filled in here.
+    A spotify_id already staged in this batch is ignored.
+
+    Returns:
+        the artist id the rows were staged under, or None if it was already staged
+    """
+    spotify_id = artist['spotify_id']
+    if spotify_id in self.staged:
+      return None
+    now = datetime.now()
+    artist_id = uuid.uuid4()
+    artist_row = {
+      'id': artist_id,
+      'onboard_wait_until': None,
+      'active': True,
+      'created_at': now,
+      'updated_at': now,
+    }
+    artist_row.update(artist)
+    evaluation_row = {'created_at': now, 'updated_at': now}
+    evaluation_row.update(evaluation)
+    evaluation_row['artist_id'] = artist_id
+
+    staged = {'artist': artist_row, 'evaluation': evaluation_row}
+    children = {
+      'organizations': organizations, 'users': users, 'statistics': statistics,
+      'links': links, 'attributions': attributions,
+    }
+    for key, rows in children.items():
+      staged[key] = [dict(row, artist_id=artist_id) for row in rows]
+    self.staged[spotify_id] = staged
+    return artist_id
+
+  def flush(self, sql_session, commit=True):
+    """
+    Write everything staged in one transaction; rolled back as a whole on any error.
+
+    Returns:
+        tuple: (inserted spotify ids, skipped spotify ids that already existed)
+    """
+    staged = list(self.staged.values())
+    self.staged = {}
+    if len(staged) == 0:
+      return [], []
+    try:
+      # artists.evaluation_id is required, so evaluations go first and are matched back by artist_id
+      evaluation_ids = {}
+      for chunk in self.__chunks([s['evaluation'] for s in staged]):
+        stmt = insert(Evaluation).values(chunk).returning(Evaluation.id, Evaluation.artist_id)
+        for evaluation_id, artist_id in sql_session.execute(stmt):
+          evaluation_ids[str(artist_id)] = evaluation_id
+
+      artist_rows = [dict(s['artist'], evaluation_id=evaluation_ids[str(s['artist']['id'])]) for s in staged]
+      inserted_ids = set()
+      for chunk in self.__chunks(artist_rows):
+        stmt = insert(Artist).values(chunk).on_conflict_do_nothing(index_elements=['spotify_id']).returning(Artist.id)
+        inserted_ids.update(str(artist_id) for artist_id in sql_session.scalars(stmt))
+
+      inserted = [s for s in staged if str(s['artist']['id']) in inserted_ids]
+      skipped = [s for s in staged if str(s['artist']['id']) not in inserted_ids]
+      if len(skipped) > 0:
+        orphaned = [evaluation_ids[str(s['artist']['id'])] for s in skipped]
+        sql_session.execute(delete(Evaluation).where(Evaluation.id.in_(orphaned)))
+
+      for key, model in CHILD_TABLES:
+        rows = [row for s in inserted for row in s[key]]
+        for chunk in self.__chunks(rows):
+          sql_session.execute(insert(model).values(chunk).on_conflict_do_nothing())
+      if commit:
+        sql_session.commit()
+    except Exception:
+      sql_session.rollback()
+      raise
+    return [s['artist']['spotify_id'] for s in inserted], [s['artist']['spotify_id'] for s in skipped]
+
+  def __chunks(self, rows: list):
+    for i in range(0, len(rows), self.chunk_size):
+      yield rows[i:i + self.chunk_size]
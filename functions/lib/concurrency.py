@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+def map_concurrently(fn, items: list, max_workers: int = 4, return_exceptions=False):
+  """
+  Run fn over items on a bounded thread pool.
+
+  Returns the results in input order. Small inputs run inline to skip the pool overhead.
+  With return_exceptions, an item that raises gets its exception in place of a result
+  instead of failing the whole map.
+  """
+  items = list(items)
+  def safe(item):
+    try:
+      return fn(item)
+    except Exception as e:
+      return e
+  call = safe if return_exceptions else fn
+  if len(items) <= 1 or max_workers <= 1:
+    return [call(item) for item in items]
+  with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+    return list(executor.map(call, items))
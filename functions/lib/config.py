@@ -25,6 +25,7 @@ SPOTIFY_ALT_CLIENT_ID = StringParam("SPOTIFY_ALT_CLIENT_ID").value
 SPOTIFY_ALT_CLIENT_SECRET = StringParam("SPOTIFY_ALT_CLIENT_SECRET").value
 SPOTIFY_USER_FACING_CLIENT_ID = StringParam("SPOTIFY_USER_FACING_CLIENT_ID").value
 SPOTIFY_USER_FACING_CLIENT_SECRET = StringParam("SPOTIFY_USER_FACING_CLIENT_SECRET").value
+SPOTIFY_CACHE_LAYOUT = StringParam("SPOTIFY_CACHE_LAYOUT", default="query").value
 
 
 TWILIO_VERIFY_SERVICE = StringParam("TWILIO_VERIFY_SERVICE").value
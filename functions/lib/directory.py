@@ -0,0 +1,86 @@
+import threading
+from datetime import timedelta
+
+from google.cloud.firestore_v1 import Client
+
+from .memory_cache import TTLCache
+
+# Firestore get_all is batched client side; keep each call to a modest number of refs
+GET_ALL_CHUNK = 100
+
+
+class UserDirectory():
+  """
+  Process wide, TTL bound cache of users docs for user -> organization lookups.
+
+  Users are loaded on demand with point reads of just the ids asked for, so a lookup costs reads
+  for the users it references rather than for the whole collection. Missing users are cached too.
+  """
+  def __init__(self, db: Client, ttl: timedelta = timedelta(minutes=15), max_size: int = 20000):
+    self.db = db
+    self.ttl = ttl
+    self.users = TTLCache(max_size=max_size, default_ttl=ttl)
+    self.reads = 0
+
+  def get_users(self, user_ids: list):
+    """
+    User docs for user_ids as a dict, loading the ones not cached. Users that don't exist are left out.
+    """
+    user_ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+    found = {}
+    missing = []
+    for user_id in user_ids:
+      entry = self.users.get(user_id)
+      if entry is None:
+        missing.append(user_id)
+      elif entry.get('exists'):
+        found[user_id] = entry['data']
+    for i in range(0, len(missing), GET_ALL_CHUNK):
+      chunk = missing[i:i + GET_ALL_CHUNK]
+      refs = [self.db.collection('users').document(user_id) for user_id in chunk]
+      loaded = set()
+      for snapshot in self.db.get_all(refs):
+        loaded.add(snapshot.id)
+        data = snapshot.to_dict() if snapshot.exists else None
+        self.users.set(snapshot.id, {'exists': snapshot.exists, 'data': data})
+        if snapshot.exists:
+          found[snapshot.id] = data
+      for user_id in chunk:
+        if user_id not in loaded:
+          self.users.set(user_id, {'exists': False, 'data': None})
+      self.reads += len(chunk)
+    return found
+
+  def organizations_for(self, user_ids: list):
+    """
+    user id -> organization id for the users in user_ids that exist.
+    """
+    return {user_id: data.get('organization') for user_id, data in self.get_users(user_ids).items()}
+
+  def organization_for(self, user_id: str):
+    return self.organizations_for([user_id]).get(user_id)
+
+  def invalidate(self, user_id: str = None):
+    if user_id is None:
+      self.users.clear()
+    else:
+      self.users.delete(user_id)
+
+  def stats(self):
+    stats = self.users.stats()
+    stats['reads'] = self.reads
+    return stats
+
+
+directories = {}
+directories_lock = threading.Lock()
+
+
+def user_directory(db: Client):
+  """
+  The shared directory for db, so every controller in the instance reuses the same cache.
+  """
+  with directories_lock:
+    if id(db) not in directories:
+      directories[id(db)] = UserDirectory(db)
+    return directories[id(db)]
@@ -0,0 +1,66 @@
+import threading
+
+from google.cloud.firestore_v1 import Client
+
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_OPERATIONS = 500
+
+
+class BatchWriter():
+  """
+  Write-behind buffer that groups Firestore writes into WriteBatch commits.
+
+  Writes are queued until flush() is called, or committed early whenever the
+  queue reaches the batch operation limit.
+  """
+  def __init__(self, db: Client, max_operations: int = MAX_BATCH_OPERATIONS):
+    self.db = db
+    self.max_operations = min(max_operations, MAX_BATCH_OPERATIONS)
+    self.operations = []
+    self.lock = threading.Lock()
+    self.commits = 0
+
+  def set(self, ref, data: dict, merge=False):
+    self.__queue(('set', ref, data, merge))
+
+  def update(self, ref, data: dict):
+    self.__queue(('update', ref, data, None))
+
+  def delete(self, ref):
+    self.__queue(('delete', ref, None, None))
+
+  def pending(self):
+    with self.lock:
+      return len(self.operations)
+
+  def flush(self):
+    with self.lock:
+      operations = self.operations
+      self.operations = []
+    for i in range(0, len(operations), self.max_operations):
+      self.__commit(operations[i:i + self.max_operations])
+
+  def __queue(self, operation):
+    full = None
+    with self.lock:
+      self.operations.append(operation)
+      if len(self.operations) >= self.max_operations:
+        full = self.operations
+        self.operations = []
+    if full is not None:
+      self.__commit(full)
+
+  def __commit(self, operations):
+    if len(operations) == 0:
+      return
+    batch = self.db.batch()
+    for action, ref, data, merge in operations:
+      if action == 'set':
+        batch.set(ref, data, merge=merge)
+      elif action == 'update':
+        batch.update(ref, data)
+      else:
+        batch.delete(ref)
+    batch.commit()
+    self.commits += 1
+    print(f"Firestore batch committed: {len(operations)} write(s)")
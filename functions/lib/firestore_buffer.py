@@ -0,0 +1,189 @@
+import copy
+import functools
+import threading
+from contextlib import contextmanager
+
+from google.cloud.firestore_v1 import Client
+from google.cloud.firestore_v1.transforms import Sentinel
+
+from .firestore_batch import BatchWriter
+
+
+class BufferedDocument():
+  """
+  Read view of a buffered doc: the snapshot it was loaded from with the buffered writes applied.
+  Quacks like a DocumentSnapshot for exists, id, reference, get() and to_dict().
+  """
+  def __init__(self, reference, data: dict|None):
+    self.reference = reference
+    self.id = reference.id
+    self.data = data
+
+  @property
+  def exists(self):
+    return self.data is not None
+
+  def to_dict(self):
+    return copy.deepcopy(self.data) if self.data is not None else None
+
+  def get(self, field_path: str):
+    if self.data is None:
+      return None
+    value = self.data
+    for part in field_path.split('.'):
+      if not isinstance(value, dict) or part not in value:
+        raise KeyError(f"'{field_path}' is not contained in the data")
+      value = value[part]
+    return copy.deepcopy(value)
+
+
+class DocumentBuffer():
+  """
+  Per request read-through, write-behind buffer for Firestore docs.
+
+  Each doc is read at most once; later reads are served from that snapshot with the buffered
+  writes applied. update()s to the same doc are merged (top level fields, last write wins) and
+  flush() sends one write per doc, batched when there's more than one.
+
+  Callers wrap a unit of work in `with buffer.session():`; the outermost session flushes on exit,
+  even when it raises, since the writes made up to that point would have been sent already
+  without the buffer, and then forgets its snapshots so the next unit of work reads fresh.
+  """
+  def __init__(self, db: Client):
+    self.db = db
+    self.documents = {}
+    self.writes = {}
+    self.depth = 0
+    self.lock = threading.RLock()
+    self.reads = 0
+    self.flushed = 0
+
+  @contextmanager
+  def session(self):
+    with self.lock:
+      self.depth += 1
+    try:
+      yield self
+    finally:
+      with self.lock:
+        self.depth -= 1
+        outermost = self.depth == 0
+      if outermost:
+        try:
+          self.flush()
+        finally:
+          self.clear()
+
+  def get(self, ref):
+    return self.get_all([ref])[0]
+
+  def get_all(self, refs: list):
+    """
+    Views for refs, in order, reading the ones not buffered yet in a single get_all.
+    """
+    with self.lock:
+      missing = [ref for ref in refs if ref.path not in self.documents]
+    if len(missing) > 0:
+      snapshots = {snapshot.reference.path: snapshot for snapshot in self.db.get_all(missing)}
+      with self.lock:
+        self.reads += len(missing)
+        for ref in missing:
+          if ref.path in self.documents:
+            continue
+          snapshot = snapshots.get(ref.path)
+          data = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+          self.documents[ref.path] = BufferedDocument(ref, data)
+          # writes buffered before the first read still apply on top of it
+          if ref.path in self.writes:
+            self.__apply(ref.path, self.writes[ref.path])
+    with self.lock:
+      return [self.documents[ref.path] for ref in refs]
+
+  def update(self, ref, data: dict):
+    with self.lock:
+      write = self.writes.get(ref.path)
+      if write is None:
+        self.writes[ref.path] = write = {'ref': ref, 'action': 'update', 'data': {}}
+      if write['action'] == 'set':
+        # an update after a set folds into the set
+        write['data'] = self.__merged(write['data'], data)
+      else:
+        write['data'].update(data)
+      if ref.path in self.documents:
+        self.__apply(ref.path, {'action': 'update', 'data': data})
+
+  def set(self, ref, data: dict):
+    with self.lock:
+      self.writes[ref.path] = {'ref': ref, 'action': 'set', 'data': dict(data)}
+      self.documents[ref.path] = BufferedDocument(ref, None)
+      self.__apply(ref.path, self.writes[ref.path])
+
+  def pending(self):
+    with self.lock:
+      return len(self.writes)
+
+  def flush(self):
+    """
+    Send the buffered writes, one per doc. Returns the number of docs written.
+    """
+    with self.lock:
+      writes = list(self.writes.values())
+      self.writes = {}
+    if len(writes) == 0:
+      return 0
+    if len(writes) == 1:
+      write = writes[0]
+      if write['action'] == 'set':
+        write['ref'].set(write['data'])
+      else:
+        write['ref'].update(write['data'])
+    else:
+      writer = BatchWriter(self.db)
+      for write in writes:
+        if write['action'] == 'set':
+          writer.set(write['ref'], write['data'])
+        else:
+          writer.update(write['ref'], write['data'])
+      writer.flush()
+    with self.lock:
+      self.flushed += len(writes)
+    return len(writes)
+
+  def clear(self):
+    with self.lock:
+      self.documents = {}
+      self.writes = {}
+
+  def stats(self):
+    with self.lock:
+      return {'reads': self.reads, 'flushed': self.flushed, 'pending': len(self.writes)}
+
+  def __apply(self, path: str, write: dict):
+    document = self.documents[path]
+    if write['action'] == 'set':
+      document.data = self.__merged({}, write['data'])
+    elif document.data is not None:
+      # an update of a missing doc stays missing, the write fails on flush as it would have directly
+      document.data = self.__merged(document.data, write['data'])
+
+  def __merged(self, data: dict, changes: dict):
+    data = dict(data)
+    for field, value in changes.items():
+      if isinstance(value, Sentinel):
+        # DELETE_FIELD removes the field, server side transforms (eg. SERVER_TIMESTAMP) aren't known until written
+        data.pop(field, None)
+      else:
+        data[field] = value
+    return data
+
+
+def buffered_documents(method):
+  """
+  Run a method of an object with a DocumentBuffer at self.documents inside a buffer session, so
+  the writes it (and any buffered method it calls) makes go out once, when the outermost one returns.
+  """
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    with self.documents.session():
+      return method(self, *args, **kwargs)
+  return wrapper
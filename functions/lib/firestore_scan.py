@@ -0,0 +1,100 @@
+from datetime import datetime
+
+from google.cloud.firestore_v1 import Client, ArrayUnion
+
+# Firestore collection the scan checkpoints live in, one doc per run
+SCAN_CHECKPOINT_COLLECTION = 'scan_checkpoints'
+
+# scans are ordered by document id so a cursor is just the id of the last doc read
+SCAN_ORDER = '__name__'
+
+
+def page_query(query, page_size: int, cursor: str = None):
+  """
+  One page of query in document id order, starting after the doc with id cursor (from the start if None).
+  """
+  query = query.order_by(SCAN_ORDER)
+  if cursor is not None:
+    query = query.start_after({SCAN_ORDER: cursor})
+  return query.limit(page_size)
+
+
+def stream_pages(query, page_size: int, cursor: str = None):
+  """
+  Every doc of query as pages of up to page_size snapshots, continuing from cursor.
+
+  Pages are read with start_after on the previous page's last doc, so each doc is read once
+  however far into the collection the scan is (an offset re-reads every skipped doc).
+
+  Yields:
+      tuple: (page snapshots, cursor to resume after this page)
+  """
+  while True:
+    page = list(page_query(query, page_size, cursor).stream())
+    if len(page) == 0:
+      return
+    cursor = page[-1].id
+    yield page, cursor
+    if len(page) < page_size:
+      return
+
+
+def stream_documents(query, page_size: int = 500, cursor: str = None):
+  for page, _ in stream_pages(query, page_size, cursor):
+    yield from page
+
+
+def page_cursors(query, page_size: int):
+  """
+  The start cursor of every page of query (None for the first), from a scan that only reads doc ids,
+  so pages can be fanned out to tasks up front.
+  """
+  cursors = [None]
+  count = 0
+  for doc in stream_documents(query.select([SCAN_ORDER]), page_size):
+    count += 1
+    if count % page_size == 0:
+      cursors.append(doc.id)
+  if count > 0 and count % page_size == 0:
+    cursors.pop()
+  return cursors
+
+
+class ScanCheckpoint():
+  """
+  Progress of a paged scan run as tasks, kept in scan_checkpoints/{name}: the page cursors
+  it was started with and the ones completed, so an interrupted run can re-dispatch only what's left.
+  """
+  def __init__(self, db: Client, name: str):
+    self.db = db
+    self.name = name
+    self.ref = db.collection(SCAN_CHECKPOINT_COLLECTION).document(name)
+
+  def start(self, cursors: list, page_size: int):
+    self.ref.set({
+      'cursors': [cursor or '' for cursor in cursors],
+      'completed': [],
+      'page_size': page_size,
+      'started_at': datetime.now(),
+      'updated_at': datetime.now(),
+    })
+
+  def complete(self, cursor: str = None):
+    self.ref.update({
+      'completed': ArrayUnion([cursor or '']),
+      'updated_at': datetime.now(),
+    })
+
+  def load(self):
+    doc = self.ref.get()
+    return doc.to_dict() if doc.exists else None
+
+  def pending(self, data: dict = None):
+    """
+    Start cursors of the pages not completed yet, or None if the run doesn't exist.
+    """
+    data = data if data is not None else self.load()
+    if data is None:
+      return None
+    completed = set(data.get('completed', []))
+    return [cursor or None for cursor in data.get('cursors', []) if cursor not in completed]
@@ -0,0 +1,59 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = 15
+POOL_MAXSIZE = 10
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+class TimeoutSession(requests.Session):
+  """
+  requests.Session that applies a default timeout to every request that doesn't set one.
+  """
+  def __init__(self, timeout=DEFAULT_TIMEOUT):
+    super().__init__()
+    self.timeout = timeout
+
+  def request(self, method, url, **kwargs):
+    kwargs.setdefault('timeout', self.timeout)
+    return super().request(method, url, **kwargs)
+
+
+def build_session(timeout=DEFAULT_TIMEOUT, pool_maxsize=POOL_MAXSIZE):
+  session = TimeoutSession(timeout)
+  # retry connection failures, and gateway errors on idempotent requests only;
+  # rate limits (429) are left to the clients, which each have their own handling
+  retry = Retry(
+    total=2,
+    connect=2,
+    read=0,
+    status=2,
+    backoff_factor=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+    respect_retry_after_header=False,
+    raise_on_status=False,
+  )
+  adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+  session.mount('https://', adapter)
+  session.mount('http://', adapter)
+  return session
+
+
+def session_for(url: str):
+  """
+  Shared keep-alive session for the host of url, created on first use and reused for the life of the instance.
+  """
+  host = urlsplit(url).netloc
+  with sessions_lock:
+    session = sessions.get(host)
+    if session is None:
+      session = build_session()
+      sessions[host] = session
+    return session
@@ -0,0 +1,108 @@
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from .models import LinkSource
+
+# how long a process keeps its link sources before reading the table again
+LINK_SOURCES_TTL = timedelta(minutes=10)
+# an unknown source key triggers a reload, at most this often
+UNKNOWN_SOURCE_RELOAD = timedelta(minutes=1)
+
+SCHEME_PREFIXES = ('https://', 'http://', 'www.')
+
+
+@dataclass(frozen=True)
+class LinkSourcePattern:
+  id: int
+  key: str
+  url_scheme: str
+  pattern: re.Pattern
+
+
+def strip_scheme(url: str):
+  for prefix in SCHEME_PREFIXES:
+    url = url.replace(prefix, '')
+  return url
+
+
+def compile_url_scheme(url_scheme: str):
+  """
+  Regex pulling the {identifier} out of a url for url_scheme, with or without protocol and www.
+
+  The identifier runs up to the part of the scheme after {identifier} or the query string, whichever
+  comes first, same as the split based parsing it replaces.
+  """
+  before, after = url_scheme.split('{identifier}', 1)
+  prefix = re.escape(strip_scheme(before))
+  end = (re.escape(after) + '|') if len(after) > 0 else ''
+  return re.compile(r'^(?:https?://)?(?:www\.)?(?:' + prefix + r')?(?P<identifier>[^?]*?)(?:' + end + r'\?|$)')
+
+
+class LinkNormalizer():
+  """
+  Link sources keyed by key, each with its url_scheme compiled once, for turning firestore
+  {source, url} links into (link_source_id, path).
+  """
+  def __init__(self, sources: list):
+    self.sources = {}
+    for source in sources:
+      self.sources[source.key] = LinkSourcePattern(source.id, source.key, source.url_scheme,
+                                                   compile_url_scheme(source.url_scheme))
+    self.built_at = datetime.now()
+
+  def source_for(self, key: str, url: str):
+    source = self.sources.get(key)
+    if source is not None and source.key == 'twitter' and 'x.com' in url:
+      source = self.sources.get('x', source)
+    return source
+
+  def parse(self, key: str, url: str):
+    """
+    Returns:
+        tuple: (link_source_id, path), or None when key isn't a known source
+    """
+    source = self.source_for(key, url)
+    if source is None:
+      return None
+    match = source.pattern.match(url)
+    return source.id, match.group('identifier')
+
+  def has_source(self, key: str):
+    return key in self.sources
+
+
+normalizer = None
+normalizer_lock = threading.Lock()
+
+
+def link_normalizer(sql_session, keys: list = ()):
+  """
+  The process wide normalizer, rebuilt from link_sources once it's older than LINK_SOURCES_TTL,
+  or when one of keys isn't a known source and it wasn't rebuilt within UNKNOWN_SOURCE_RELOAD.
+  """
+  global normalizer
+  with normalizer_lock:
+    current = normalizer
+  now = datetime.now()
+  if current is not None:
+    stale = current.built_at <= now - LINK_SOURCES_TTL
+    unknown = any(not current.has_source(key) for key in keys) and current.built_at <= now - UNKNOWN_SOURCE_RELOAD
+    if not stale and not unknown:
+      return current
+  current = LinkNormalizer(sql_session.scalars(select(LinkSource)).all())
+  with normalizer_lock:
+    normalizer = current
+  return current
+
+
+def invalidate_link_normalizer():
+  """
+  Drop the cached link sources, eg. after adding or changing one.
+  """
+  global normalizer
+  with normalizer_lock:
+    normalizer = None
@@ -0,0 +1,92 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+class TTLCache():
+  """
+  Size bounded, thread safe LRU cache with a per-entry expiry.
+
+  Bounded by entry count and, when max_bytes is given, by the approximate size callers pass to set();
+  the least recently used entries go first once either is exceeded.
+
+  Entries are stored with the time they were cached so callers can apply a
+  tighter freshness window than the entry TTL (eg. get_cached's expires_delta).
+  """
+  def __init__(self, max_size: int = 5000, default_ttl: timedelta|None = None, max_bytes: int|None = None):
+    self.max_size = max_size
+    self.max_bytes = max_bytes
+    self.default_ttl = default_ttl
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+
+  def get(self, key, max_age: timedelta|None = None):
+    now = datetime.now()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return None
+      value, cached_at, expires_at, _ = entry
+      if expires_at is not None and expires_at <= now:
+        self.__remove(key)
+        self.expirations += 1
+        self.misses += 1
+        return None
+      if max_age is not None and cached_at <= now - max_age:
+        self.misses += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def set(self, key, value, ttl: timedelta|None = None, cached_at: datetime|None = None, size: int = 0):
+    """
+    Returns:
+        bool: whether value was stored, entries bigger than max_bytes on their own aren't
+    """
+    ttl = ttl if ttl is not None else self.default_ttl
+    cached_at = cached_at if cached_at is not None else datetime.now()
+    with self.lock:
+      self.__remove(key)
+      if self.max_bytes is not None and size > self.max_bytes:
+        return False
+      self.entries[key] = (value, cached_at, cached_at + ttl if ttl is not None else None, size)
+      self.bytes += size
+      while len(self.entries) > self.max_size or (self.max_bytes is not None and self.bytes > self.max_bytes):
+        _, evicted = self.entries.popitem(last=False)
+        self.bytes -= evicted[3]
+        self.evictions += 1
+      return True
+
+  def delete(self, key):
+    with self.lock:
+      self.__remove(key)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.bytes = 0
+
+  def stats(self):
+    with self.lock:
+      return {
+        "size": len(self.entries),
+        "max_size": self.max_size,
+        "bytes": self.bytes,
+        "max_bytes": self.max_bytes,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "expirations": self.expirations,
+      }
+
+  def __remove(self, key):
+    entry = self.entries.pop(key, None)
+    if entry is not None:
+      self.bytes -= entry[3]
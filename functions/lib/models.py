@@ -4,7 +4,7 @@ from typing import List, Optional
 
 from dataclasses import dataclass
 from sqlalchemy import Column, Integer, SmallInteger, JSON, Float, Boolean, Text, String, TIMESTAMP, create_engine, \
-    ForeignKey, DateTime, select, func, and_
+    ForeignKey, DateTime, Date, select, func, and_
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import Mapped, relationship, mapped_column
@@ -265,6 +265,22 @@ class Statistic(Base):
     def __repr__(self):
         return f"<Statistic({self.artist_id=}-{self.statistic_type_id}, {self.latest}, {self.previous=}, {self.day_over_day=}, {self.week_over_week=}, {self.month_over_month=}, {self.min}, {self.max}, {self.avg}, {self.data})>"
 
+class StatisticArchive(Base):
+    __tablename__ = 'statistic_archive'
+    # range partitioned by month, see lib/stat_archive.py for the DDL
+    __table_args__ = {'postgresql_partition_by': 'RANGE (date)'}
+    artist_id: Mapped[UUID] = mapped_column(UUID(as_uuid=True), ForeignKey('artists.id'), nullable=False, primary_key=True)
+    statistic_type_id: Mapped[int] = mapped_column(Integer, ForeignKey('statistic_types.id'), nullable=False, primary_key=True)
+    date = Column(Date, nullable=False, primary_key=True)
+    value = Column(Float, nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False, default=datetime.datetime.now)
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return f"<StatisticArchive({self.artist_id=}-{self.statistic_type_id}, {self.date=}, {self.value=})>"
+
 class StatisticType(Base):
     __tablename__ = 'statistic_types'
     id: Mapped[int] = mapped_column(Integer, autoincrement=True, primary_key=True)
@@ -0,0 +1,90 @@
+import threading
+from datetime import datetime, timedelta
+
+from .errors import ErrorResponse
+from .memory_cache import TTLCache
+
+
+class NegativeCache():
+  """
+  Remembers lookups that failed with a status worth not repeating (invalid or missing ids),
+  so callers can fail fast instead of spending API quota on the same dead id.
+
+  ttls maps source -> status code -> how long a failure with that status is remembered.
+  Statuses without a policy (eg. 429s and 5xx) are never cached.
+  """
+  def __init__(self, ttls: dict, max_size: int = 10000):
+    self.ttls = ttls
+    self.entries = TTLCache(max_size=max_size)
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.stored = {}
+
+  def key(self, source: str, lookup_type: str, lookup_id: str):
+    return f"{source}:{lookup_type}:{lookup_id}"
+
+  def get(self, key):
+    """
+    The cached failure for key as (status_code, data, source, expires_at), or None.
+    """
+    entry = self.entries.get(key)
+    if entry is not None:
+      with self.lock:
+        self.hits += 1
+    return entry
+
+  def check(self, key):
+    """
+    Raise the cached failure for key again, if there is one.
+    """
+    entry = self.get(key)
+    if entry is not None:
+      status_code, data, source, _ = entry
+      raise ErrorResponse(data, status_code, source)
+
+  def record(self, key, error: ErrorResponse):
+    """
+    Remember error for key if its status has a TTL policy. Returns whether it was cached.
+    """
+    ttl = self.ttls.get(error.source, {}).get(error.status_code)
+    if ttl is None:
+      return False
+    self.entries.set(key, (error.status_code, error.data, error.source, datetime.now() + ttl), ttl)
+    with self.lock:
+      counter = f"{error.source}:{error.status_code}"
+      self.stored[counter] = self.stored.get(counter, 0) + 1
+    return True
+
+  def expires_at(self, key):
+    entry = self.entries.get(key)
+    return entry[3] if entry is not None else None
+
+  def stats(self):
+    entries = self.entries.stats()
+    with self.lock:
+      return {
+        "size": entries["size"],
+        "hits": self.hits,
+        "stored": dict(self.stored),
+        "evictions": entries["evictions"],
+        "expirations": entries["expirations"],
+      }
+
+
+# TTL policy by source, then status code
+NEGATIVE_CACHE_TTLS = {
+  # invalid ids never become valid; removed artists/albums occasionally come back
+  'Spotify': {
+    400: timedelta(days=7),
+    404: timedelta(days=1),
+  },
+  # 300/302/404 mean songstats hasn't ingested the artist yet, so these stay short
+  'Songstats': {
+    300: timedelta(minutes=30),
+    302: timedelta(minutes=30),
+    404: timedelta(hours=2),
+  },
+}
+
+# shared by the Spotify and Songstats clients in the instance
+negative_cache = NegativeCache(NEGATIVE_CACHE_TTLS)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+
+class TokenBucket():
+  """
+  Token bucket that refills at `rate` tokens per second up to `capacity`.
+
+  A server supplied Retry-After blocks the bucket until it has passed.
+  """
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+    self.blocked_until = 0.0
+    self.lock = threading.Lock()
+
+  def __refill(self, now):
+    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+  def remaining(self):
+    now = time.monotonic()
+    with self.lock:
+      self.__refill(now)
+      if self.blocked_until > now:
+        return 0.0
+      return self.tokens
+
+  def wait_time(self):
+    now = time.monotonic()
+    with self.lock:
+      self.__refill(now)
+      blocked = max(0.0, self.blocked_until - now)
+      missing = max(0.0, 1 - self.tokens)
+      return max(blocked, missing / self.rate)
+
+  def try_acquire(self):
+    now = time.monotonic()
+    with self.lock:
+      self.__refill(now)
+      if self.blocked_until > now or self.tokens < 1:
+        return False
+      self.tokens -= 1
+      return True
+
+  def acquire(self, wait=True, max_wait: float = 30.0):
+    """
+    Take a token. When wait is set, sleeps until one is available, giving up after max_wait seconds.
+    """
+    deadline = time.monotonic() + max_wait
+    while not self.try_acquire():
+      if not wait:
+        return False
+      delay = self.wait_time()
+      if time.monotonic() + delay > deadline:
+        return False
+      time.sleep(max(delay, 0.01))
+    return True
+
+  def block_for(self, seconds: float):
+    now = time.monotonic()
+    with self.lock:
+      self.blocked_until = max(self.blocked_until, now + seconds)
+      self.tokens = 0
+
+
+class RateLimiter():
+  """
+  Process wide registry of token buckets, one per credential.
+  """
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.buckets = {}
+    self.lock = threading.Lock()
+
+  def bucket(self, key: str):
+    with self.lock:
+      if key not in self.buckets:
+        self.buckets[key] = TokenBucket(self.rate, self.capacity)
+      return self.buckets[key]
+
+  def most_available(self, keys: list):
+    """
+    Pick the key whose bucket has the most budget left (first key wins ties).
+    """
+    return max(keys, key=lambda k: self.bucket(k).remaining())
+
+
+def parse_retry_after(value, default: float = 1.0):
+  try:
+    return max(0.0, float(value))
+  except (TypeError, ValueError):
+    return default
@@ -0,0 +1,61 @@
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+
+
+class Reconciliation():
+  """
+  What it takes to turn a set of existing rows into a desired set, compared by a composite key.
+
+  inserts are the desired rows (dicts) whose key isn't there yet, first one winning on duplicate keys;
+  deletes are the existing rows (ORM objects) whose key isn't desired.
+  """
+  def __init__(self, inserts: list, deletes: list):
+    self.inserts = inserts
+    self.deletes = deletes
+
+  def empty(self):
+    return len(self.inserts) == 0 and len(self.deletes) == 0
+
+
+def diff_by_key(desired: list, existing: list, key, desired_key=None, delete_missing=True):
+  """
+  Diff desired rows against existing ones with set lookups, rather than scanning one list per item.
+
+  Args:
+      desired: rows as column dicts
+      existing: current ORM rows
+      key: existing row -> hashable key
+      desired_key: desired row -> key, defaults to key
+      delete_missing: when False only inserts are computed (add only reconciliations)
+  """
+  desired_key = desired_key if desired_key is not None else key
+  existing_keys = set(key(row) for row in existing)
+  inserts = []
+  desired_keys = set()
+  for row in desired:
+    row_key = desired_key(row)
+    if row_key in desired_keys:
+      continue
+    desired_keys.add(row_key)
+    if row_key not in existing_keys:
+      inserts.append(row)
+  deletes = [row for row in existing if key(row) not in desired_keys] if delete_missing else []
+  return Reconciliation(inserts, deletes)
+
+
+def apply_reconciliation(sql_session, model, reconciliation: Reconciliation, commit=True):
+  """
+  Write a reconciliation as at most one INSERT and one DELETE by id for model's table.
+
+  Returns:
+      bool: whether anything was written
+  """
+  if reconciliation.empty():
+    return False
+  if len(reconciliation.deletes) > 0:
+    sql_session.execute(delete(model).where(model.id.in_([row.id for row in reconciliation.deletes])))
+  if len(reconciliation.inserts) > 0:
+    sql_session.execute(insert(model).values(reconciliation.inserts))
+  if commit:
+    sql_session.commit()
+  return True
@@ -0,0 +1,150 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from requests.exceptions import ConnectionError, Timeout
+
+# Firestore collection the breaker state is mirrored to, one doc per breaker name
+CIRCUIT_BREAKER_COLLECTION = 'circuit_breakers'
+
+
+def utc_now():
+  return datetime.now(timezone.utc)
+
+
+class RetryPolicy():
+  """
+  Jittered exponential backoff for idempotent requests.
+
+  Retries timeouts, dropped connections and the given statuses, up to max_attempts calls in total.
+  Each delay is drawn uniformly from 0..min(max_delay, base_delay * 2^(attempt - 1)) (full jitter).
+  """
+  def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 4.0,
+               retry_statuses: tuple = (500,), methods: tuple = ('GET', 'HEAD', 'OPTIONS')):
+    self.max_attempts = max_attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.retry_statuses = retry_statuses
+    self.methods = methods
+
+  def should_retry(self, method: str, attempt: int, status_code: int = None, exception: Exception = None):
+    if method.upper() not in self.methods or attempt >= self.max_attempts:
+      return False
+    if exception is not None:
+      return isinstance(exception, (Timeout, ConnectionError))
+    return status_code in self.retry_statuses
+
+  def delay(self, attempt: int):
+    return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+  def wait(self, attempt: int):
+    time.sleep(self.delay(attempt))
+
+
+class CircuitBreaker():
+  """
+  Opens after `threshold` failures inside `window` and stays open for `cooldown`.
+
+  When a Firestore client is attached, opening is mirrored to circuit_breakers/{name} and the
+  open state is re-read at most every sync_interval, so other instances and the cron jobs
+  see a breaker one instance opened.
+  """
+  def __init__(self, name: str, threshold: int = 5, window: timedelta = timedelta(minutes=1),
+               cooldown: timedelta = timedelta(minutes=5), sync_interval: timedelta = timedelta(seconds=30), db=None):
+    self.name = name
+    self.threshold = threshold
+    self.window = window
+    self.cooldown = cooldown
+    self.sync_interval = sync_interval
+    self.db = db
+    self.failures = []
+    self.opened_until = None
+    self.synced_at = None
+    self.lock = threading.Lock()
+
+  def attach(self, db):
+    if db is not None and self.db is None:
+      self.db = db
+
+  def record_failure(self):
+    now = utc_now()
+    with self.lock:
+      self.failures = [f for f in self.failures if f > now - self.window]
+      self.failures.append(now)
+      if len(self.failures) < self.threshold or self.__open(now):
+        return
+      self.opened_until = now + self.cooldown
+      self.failures = []
+      opened_until = self.opened_until
+    print(f"[circuit_breaker] {self.name} opened until {opened_until.isoformat()}")
+    self.__save(now, opened_until)
+
+  def record_success(self):
+    with self.lock:
+      self.failures = []
+
+  def is_open(self):
+    now = utc_now()
+    with self.lock:
+      if self.__open(now):
+        return True
+      sync = self.db is not None and (self.synced_at is None or self.synced_at <= now - self.sync_interval)
+    if sync:
+      self.__load(now)
+      with self.lock:
+        return self.__open(now)
+    return False
+
+  def status(self):
+    open = self.is_open()
+    with self.lock:
+      return {
+        "name": self.name,
+        "open": open,
+        "open_until": self.opened_until,
+        "recent_failures": len(self.failures),
+      }
+
+  def __open(self, now):
+    return self.opened_until is not None and self.opened_until > now
+
+  def __save(self, now, opened_until):
+    if self.db is None:
+      return
+    try:
+      self.db.collection(CIRCUIT_BREAKER_COLLECTION).document(self.name).set({
+        "open_until": opened_until,
+        "opened_at": now,
+        "threshold": self.threshold,
+      })
+    except Exception as e:
+      print(f"[circuit_breaker] {self.name} save error: {e}")
+
+  def __load(self, now):
+    try:
+      doc = self.db.collection(CIRCUIT_BREAKER_COLLECTION).document(self.name).get()
+      opened_until = doc.to_dict().get('open_until') if doc.exists else None
+    except Exception as e:
+      print(f"[circuit_breaker] {self.name} load error: {e}")
+      opened_until = None
+    with self.lock:
+      self.synced_at = now
+      if opened_until is not None and (self.opened_until is None or opened_until > self.opened_until):
+        self.opened_until = opened_until
+
+
+breakers = {}
+breakers_lock = threading.Lock()
+
+
+def shared_breaker(name: str, db=None, **kwargs):
+  """
+  The process wide breaker for name, created on first use.
+  """
+  with breakers_lock:
+    if name not in breakers:
+      breakers[name] = CircuitBreaker(name, **kwargs)
+    breaker = breakers[name]
+  breaker.attach(db)
+  return breaker
@@ -1,32 +1,69 @@
 import traceback
 
-import requests
 import json
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from google.cloud.firestore_v1 import SERVER_TIMESTAMP
 from .errors import ErrorResponse
+from .http_sessions import session_for
+from .negative_cache import negative_cache
+from .concurrency import map_concurrently
+from .resilience import RetryPolicy, shared_breaker
+from .stat_matrix import merge_histories, merge_histories_daily, fill_gaps, matrix_to_dict
+
+# Firestore 'in' filters take at most 30 values
+CACHE_QUERY_CHUNK = 30
+# raised without calling songstats while the circuit breaker is open; callers retry shortly
+# rather than treating it like a real 429
+BREAKER_OPEN_STATUS = 503
+LOOKUP_WORKERS = 6
 
 class SongstatsClient():
-  def __init__(self, key, db=None):
+  def __init__(self, key, db=None, retry_policy: RetryPolicy = None):
     self.key = key
     self.db = db
     self.root_uri = f"https://api.songstats.com/enterprise/v1"
+    # gateway errors are already retried by the pooled session, this covers read timeouts and 500s
+    self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+    # opened by repeated 429s; shared by the instance and mirrored to Firestore for the cron jobs
+    self.breaker = shared_breaker('songstats', db)
 
   def get(self, path, data=None):
-    res = requests.get(f"{self.root_uri}{path}", timeout=5, headers= {
-      "Content-Type": "application/json",
-      "apikey": self.key
-    },
-    params=data)
+    if self.breaker.is_open():
+      print("Songstats circuit breaker open, skipping " + path)
+      raise ErrorResponse({"error": "Songstats circuit breaker open"}, BREAKER_OPEN_STATUS, "Songstats")
+    attempt = 1
+    while True:
+      try:
+        res = session_for(self.root_uri).get(f"{self.root_uri}{path}", timeout=5, headers= {
+          "Content-Type": "application/json",
+          "apikey": self.key
+        },
+        params=data)
+      except Exception as e:
+        if not self.retry_policy.should_retry('GET', attempt, exception=e):
+          raise e
+        print(f"Songstats request failed ({type(e).__name__}), retrying: {path}")
+        self.retry_policy.wait(attempt)
+        attempt += 1
+        continue
+      if self.retry_policy.should_retry('GET', attempt, status_code=res.status_code):
+        print(f"Songstats {res.status_code}, retrying: {path}")
+        self.retry_policy.wait(attempt)
+        attempt += 1
+        continue
+      break
     # print(res.json())
     if res.status_code > 299:
       print(res.status_code)
       if res.status_code == 429:
         print("Songstats Rate Limiting")
+        self.breaker.record_failure()
 
 
       raise ErrorResponse(res.json(), res.status_code, "Songstats")
+    self.breaker.record_success()
     return res.json()
 
   def get_cached_artist_info(self, lookup_id: str, lookup_type: str, expires_delta: timedelta = timedelta(days=3)):
@@ -34,64 +71,94 @@ class SongstatsClient():
     Cached wrapper for /artists/info. Stores full response in Firestore songstats_cache.
     lookup_type: "spotify" or "songstats" — determines which field to query/store by.
     """
-    # Build the API params for a direct call
+    result = self.get_cached_artist_infos([lookup_id], lookup_type, expires_delta)[0]
+    if isinstance(result, Exception):
+      raise result
+    return result
+
+  def fetch_artist_info(self, lookup_id: str, lookup_type: str):
+    """
+    /artists/info straight from the API, failing fast while an earlier not-found/not-ingested
+    response for the same id is still negatively cached.
+    """
+    key = negative_cache.key('Songstats', lookup_type, lookup_id)
+    negative_cache.check(key)
     if lookup_type == "spotify":
       api_params = {"spotify_artist_id": lookup_id}
-      query_field = "spotify_id"
     else:
       api_params = {"songstats_artist_id": lookup_id}
-      query_field = "songstats_id"
-
-    # No db = no cache, just hit API directly
-    if self.db is None:
+    try:
       return self.get('/artists/info', api_params)
+    except ErrorResponse as e:
+      negative_cache.record(key, e)
+      raise e
 
-    # Check cache
-    try:
-      cached_docs = self.db.collection("songstats_cache").where(
-        query_field, "==", lookup_id
-      ).limit(1).get()
+  def retry_after(self, lookup_id: str, lookup_type: str = "spotify"):
+    """
+    When a negatively cached /artists/info lookup may be tried again, or None if it isn't cached.
+    """
+    return negative_cache.expires_at(negative_cache.key('Songstats', lookup_type, lookup_id))
+
+  def negative_cache_stats(self):
+    return negative_cache.stats()
 
-      for doc in cached_docs:
-        doc_data = doc.to_dict()
-        created_at = doc_data.get('created_at')
+  def get_cached_artist_infos(self, lookup_ids: list, lookup_type: str, expires_delta: timedelta = timedelta(days=3)):
+    """
+    Cached /artists/info for many ids: one Firestore read per 30 ids for the cache check, then the
+    misses are fetched concurrently. Results are in input order, and a lookup that fails has its
+    exception in its place so one bad artist doesn't fail the rest.
+    """
+    query_field = "spotify_id" if lookup_type == "spotify" else "songstats_id"
+    lookup_ids = list(lookup_ids)
+    cached = {}
+    if self.db is not None:
+      unique_ids = list(dict.fromkeys(lookup_ids))
+      try:
+        for i in range(0, len(unique_ids), CACHE_QUERY_CHUNK):
+          docs = self.db.collection("songstats_cache").where(
+            query_field, "in", unique_ids[i:i + CACHE_QUERY_CHUNK]
+          ).get()
+          for doc in docs:
+            doc_data = doc.to_dict()
+            lookup_id = doc_data.get(query_field)
+            created_at = doc_data.get('created_at')
+            current = cached.get(lookup_id)
+            # keep the newest doc per id
+            if current is None or (created_at is not None and (current[1] is None or created_at > current[1])):
+              cached[lookup_id] = (doc, created_at, doc_data)
+      except Exception as e:
+        print(f"[songstats_cache] batch cache read error: {e}")
+        cached = {}
+
+    def lookup(lookup_id):
+      entry = cached.get(lookup_id)
+      if entry is not None:
+        doc, created_at, doc_data = entry
         if created_at and created_at.replace(tzinfo=None) > datetime.now() - expires_delta:
           print(f"[songstats_cache] HIT for {query_field}={lookup_id}")
           return doc_data['data']
-        else:
-          # Stale — fetch fresh, update in place
-          print(f"[songstats_cache] STALE for {query_field}={lookup_id}")
-          result = self.get('/artists/info', api_params)
-          spotify_id = result.get('spotify_id') or result.get('artist_info', {}).get('spotify_id') or (lookup_id if lookup_type == "spotify" else None)
-          songstats_id = result.get('id') or result.get('artist_info', {}).get('id') or (lookup_id if lookup_type == "songstats" else None)
-          doc.reference.set({
-            "spotify_id": spotify_id,
-            "songstats_id": songstats_id,
-            "data": result,
-            "created_at": SERVER_TIMESTAMP,
-          })
-          return result
-    except Exception as e:
-      # If cache read fails, log and fall through to API
-      if isinstance(e, ErrorResponse):
-        raise
-      print(f"[songstats_cache] cache read error: {e}")
-
-    # Cache miss — fetch from API
-    print(f"[songstats_cache] MISS for {query_field}={lookup_id}")
-    result = self.get('/artists/info', api_params)
-    spotify_id = result.get('spotify_id') or result.get('artist_info', {}).get('spotify_id') or (lookup_id if lookup_type == "spotify" else None)
-    songstats_id = result.get('id') or result.get('artist_info', {}).get('id') or (lookup_id if lookup_type == "songstats" else None)
-    try:
-      self.db.collection("songstats_cache").add({
+      if self.db is None:
+        return self.fetch_artist_info(lookup_id, lookup_type)
+      print(f"[songstats_cache] {'STALE' if entry is not None else 'MISS'} for {query_field}={lookup_id}")
+      result = self.fetch_artist_info(lookup_id, lookup_type)
+      spotify_id = result.get('spotify_id') or result.get('artist_info', {}).get('spotify_id') or (lookup_id if lookup_type == "spotify" else None)
+      songstats_id = result.get('id') or result.get('artist_info', {}).get('id') or (lookup_id if lookup_type == "songstats" else None)
+      cache = {
         "spotify_id": spotify_id,
         "songstats_id": songstats_id,
         "data": result,
         "created_at": SERVER_TIMESTAMP,
-      })
-    except Exception as e:
-      print(f"[songstats_cache] cache write error: {e}")
-    return result
+      }
+      try:
+        if entry is not None:
+          entry[0].reference.set(cache)
+        else:
+          self.db.collection("songstats_cache").add(cache)
+      except Exception as e:
+        print(f"[songstats_cache] cache write error: {e}")
+      return result
+
+    return map_concurrently(lookup, lookup_ids, LOOKUP_WORKERS, return_exceptions=True)
 
   def get_artist_info_songstats(self, songstats_id : str):
     return self.get_cached_artist_info(songstats_id, "songstats")
@@ -135,11 +202,12 @@ class SongstatsClient():
       
       # Get Spotify IDs for the artists
       result = []
-      
-      for songstats_artist_id in songstats_artist_ids:
+      artist_infos = self.get_cached_artist_infos(songstats_artist_ids, "songstats")
+
+      for songstats_artist_id, artist_info in zip(songstats_artist_ids, artist_infos):
         try:
-          # This could be optimized with a batch endpoint if it becomes available
-          artist_info = self.get_artist_info_songstats(songstats_artist_id)
+          if isinstance(artist_info, Exception):
+            raise artist_info
           if artist_info and 'spotify_id' in artist_info:
             spotify_id = artist_info.get('spotify_id')
             if spotify_id:
@@ -513,12 +581,76 @@ class SongstatsClient():
     daily = result_df.ffill().bfill().fillna(0).astype(int)
     return daily, True
 
-  def get_stat_days_abs(self, spotify_id : str, days : int):
+  def get_stat_days_abs(self, spotify_id : str, days : int, engine : str = 'numpy'):
     # Calculate start and end dates for daily data
     end = datetime.now().date()
     start = end - timedelta(days=days)
     res = self.get_historic_stats(spotify_id, start, end)
-    df, status = self.__merge_stats_to_df_abs_daily(res['stats'])
+    return self.normalize_daily_stats(res['stats'], engine)
+
+  def get_stat_days_abs_since(self, spotify_id : str, days : int, stored : dict, columns : dict = None, absent : list = None):
+    """
+    Incremental get_stat_days_abs: re-fetches from the last stored date to today and splices the new
+    days onto the stored series, trimmed to the same window a full fetch covers.
+
+    stored is {'stats': {key: values}, 'as_of': dates} with one value per consecutive day. columns maps a
+    key to the stat columns to read it from (first present wins), defaulting to the key itself.
+    absent lists stat columns with nothing stored; they're left out of the result unless the new days
+    report them, in which case their history is missing and None is returned too.
+    Returns None when the new days don't continue the stored ones, so the caller can do a full fetch.
+    """
+    end = datetime.now().date()
+    window_start = (end - timedelta(days=days)).strftime('%Y-%m-%d')
+    last_date = datetime.strptime(stored['as_of'][-1], '%Y-%m-%d').date()
+    keys = list(stored['stats'].keys())
+    if columns is None:
+      columns = {}
+
+    # the last stored day is fetched again since songstats may have only had partial data for it
+    res = self.get_historic_stats(spotify_id, last_date, end)
+    merged = merge_histories(res['stats'])
+    if merged is None:
+      as_of = list(stored['as_of'])
+      series = {key: list(stored['stats'][key]) for key in keys}
+    else:
+      new_dates, new_columns, matrix = merged
+      expected = [(last_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(len(new_dates))]
+      if new_dates != expected:
+        return None
+      column_index = {name: i for i, name in enumerate(new_columns)}
+      if any(name in column_index for name in (absent or [])):
+        return None
+      picked = np.full((len(new_dates), len(keys)), np.nan)
+      for k, key in enumerate(keys):
+        for name in columns.get(key, [key]):
+          if name in column_index:
+            picked[:, k] = matrix[:, column_index[name]]
+            break
+      kept = len(stored['as_of']) - 1
+      seed = [stored['stats'][key][kept - 1] for key in keys] if kept > 0 else None
+      filled = fill_gaps(picked, seed).astype(np.int64)
+      as_of = list(stored['as_of'][:kept]) + new_dates
+      series = {key: list(stored['stats'][key][:kept]) + values for key, values in zip(keys, filled.T.tolist())}
+
+    first = next((i for i, d in enumerate(as_of) if d >= window_start), len(as_of))
+    return {'stats': {key: values[first:] for key, values in series.items()}, 'as_of': as_of[first:]}
+
+  def normalize_daily_stats(self, stats : list, engine : str = 'numpy'):
+    """
+    Merge the per source daily histories into {'stats': {"{source}__{field}": [int, ...]}, 'as_of': [date, ...]},
+    gaps forward filled. The numpy engine matches the pandas one exactly and falls back to it for
+    histories it doesn't handle.
+    """
+    if engine == 'numpy':
+      try:
+        merged = merge_histories_daily(stats)
+        if merged is None:
+          return {'stats': {}, 'as_of': []}
+        dates, columns, matrix = merged
+        return {'stats': matrix_to_dict(columns, matrix), 'as_of': list(dates)}
+      except Exception as e:
+        print(f"[songstats] numpy stats merge failed, using pandas: {e}")
+    df, status = self.__merge_stats_to_df_abs_daily(stats)
     if status == False:
       return {'stats': {}, 'as_of': []}
     # stats list
@@ -528,4 +660,3 @@ class SongstatsClient():
     return {'stats': json_dict, 'as_of': dates}
   
   
- 
\ No newline at end of file
@@ -1,22 +1,72 @@
 import base64
+import copy
+import json
 import traceback
+from contextlib import contextmanager
 from datetime import timedelta, datetime
 
-import requests
 from google.cloud.firestore_v1 import Client, FieldFilter, SERVER_TIMESTAMP
 from sqlalchemy import func, select, and_
 from sqlalchemy.exc import DatabaseError
 
 from .models import SpotifyToken
 from .errors import ErrorResponse
+from .memory_cache import TTLCache
+from .negative_cache import negative_cache
+from .firestore_batch import BatchWriter
+from .concurrency import map_concurrently
+from .spotify_tokens import SpotifyTokenStore, shared_token_store
+from .rate_limit import RateLimiter, parse_retry_after
+from .http_sessions import session_for
 from requests.exceptions import JSONDecodeError
 
 last_artist = None
 last_playlist = None
 # spotify_playlists = dict()
 
+# In-process tier in front of the spotify_cache collection, shared by every client in the instance.
+# Only these object types are held in memory, each in its own LRU bounded by entry count and by the
+# approximate (JSON) size of what it holds, so a few huge playlists can't crowd out everything else
+# or take the instance (512MB) down. Together they stay under ~48MB.
+MEMORY_CACHES = {
+  'artist': TTLCache(max_size=5000, default_ttl=timedelta(days=1), max_bytes=12 * 1024 * 1024),
+  'albums-artist': TTLCache(max_size=2000, default_ttl=timedelta(days=3), max_bytes=4 * 1024 * 1024),
+  'playlist': TTLCache(max_size=100, default_ttl=timedelta(minutes=10), max_bytes=24 * 1024 * 1024),
+  'album': TTLCache(max_size=1000, default_ttl=timedelta(days=7), max_bytes=8 * 1024 * 1024),
+}
+
+# Fields kept in memory per object type, for types whose callers only read a few of them
+# (p lines read an album's copyrights and release date, and the ids of an artist's albums).
+# Memory hits for these types come back trimmed.
+MEMORY_CACHE_FIELDS = {
+  'album': ['id', 'name', 'release_date', 'copyrights'],
+  'albums-artist': ['items'],
+}
+MEMORY_CACHE_ITEM_FIELDS = {
+  'albums-artist': ['id', 'name', 'release_date'],
+}
+
+# Max ids per multi-get request, by object type
+MULTI_GET_LIMITS = {
+  'artist': 50,
+  'album': 20,
+  'track': 50,
+}
+FETCH_WORKERS = 4
+PLAYLIST_PAGE_WORKERS = 6
+
+PLAYLIST_TTL = timedelta(minutes=10)
+PLAYLIST_FIELDS = "snapshot_id,name,images,description,collaborative,public,owner,id,tracks(total,limit,next,items(track(name,artists(id,name,type)))"
+
+# Client side budget per Spotify app (keyed by client id), shared by every client in the instance
+rate_limiter = RateLimiter(rate=3.0, capacity=30)
+RATE_LIMIT_MAX_WAIT = 30
+RATE_LIMIT_MAX_ATTEMPTS = 3
+
+SPOTIFY_TOKEN_URI = "https://accounts.spotify.com/api/token"
+
 class SpotifyClient():
-  def __init__(self, db: Client, client_id, client_secret, alt_id, alt_secret, user_client_id, user_client_secret):
+  def __init__(self, db: Client, client_id, client_secret, alt_id, alt_secret, user_client_id, user_client_secret, cache_layout='query', token_store: SpotifyTokenStore = None, rate_limit_wait=True):
     self.client_id = client_id
     self.client_secret = client_secret
     self.alt_client_id = alt_id
@@ -29,45 +79,70 @@ class SpotifyClient():
     self.authorized = False
     self.authorizedAlt = False
     self.authorizedUser = False
+    self.token_store = token_store if token_store is not None else shared_token_store
+    # wait for rate limit budget (task handlers) or fail fast with a 299 (user facing requests)
+    self.rate_limit_wait = rate_limit_wait
     self.db = db
+    # 'query' (auto ID docs looked up by where/in) or 'keyed' ({type}:{spotify_id} docs read with get_all)
+    self.cache_layout = cache_layout
+    # cache fills are committed in WriteBatches, at the end of get_cached or of a deferred_cache_writes block
+    self.cache_writer = BatchWriter(db) if db is not None else None
+    self.defer_cache_writes = False
     self.root_uri = "https://api.spotify.com/v1"
 
-  def authorize(self, alt_token=False):
-    headers = {
-      "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {
-      "grant_type": "client_credentials",
-      "client_id": self.alt_client_id if alt_token else self.client_id,
-      "client_secret": self.alt_client_secret if alt_token else self.client_secret
-    }
-    print("Spotify Auth:" + (alt_token if alt_token else ' default'))
-
-    response = requests.post(f"https://accounts.spotify.com/api/token", headers=headers, data=data).json()
-    if 'error' in response:
-      if alt_token == 'alt':
-        self.alt_token = None
-      elif alt_token == 'user':
-        self.user_token = None
-      else:
-        self.access_token = None
+  def credentials(self, alt_token=False):
+    # 'alt' and 'user' requests both authorize with the alt app
+    if alt_token:
+      return self.alt_client_id, self.alt_client_secret
+    return self.client_id, self.client_secret
+
+  def authorize(self, alt_token=False, force=False):
+    client_id, client_secret = self.credentials(alt_token)
+
+    def fetch_token():
+      headers = {
+        "Content-Type": "application/x-www-form-urlencoded"
+      }
+      data = {
+        "grant_type": "client_credentials",
+        "client_id": client_id,
+        "client_secret": client_secret
+      }
+      print("Spotify Auth:" + (alt_token if alt_token else ' default'))
+
+      response = session_for(SPOTIFY_TOKEN_URI).post(SPOTIFY_TOKEN_URI, headers=headers, data=data).json()
+      if 'error' in response:
+        return None
+      return response['access_token'], response.get('expires_in', 3600)
+
+    token = self.token_store.get_token(client_id, fetch_token, force=force)
+    if alt_token == 'alt':
+      self.authorizedAlt = token is not None
+      self.alt_token = token
+    elif alt_token == 'user':
+      self.authorizedUser = token is not None
+      self.user_token = token
     else:
-      if alt_token == 'alt':
-        self.authorizedAlt = True
-        self.alt_token = response['access_token']
-      elif alt_token == 'user':
-        self.authorizedUser = True
-        self.user_token = response['access_token']
-      else:
-        self.authorized = True
-        self.access_token = response['access_token']
+      self.authorized = token is not None
+      self.access_token = token
+    return token
 
-  def get(self, path, data=None, alt_token=False, attempt=1):
-    if (self.authorizedAlt == False and alt_token == 'alt') or (self.authorized == False and alt_token == False) or (self.authorizedUser == False and alt_token == 'user'):
-      self.authorize(alt_token=alt_token)
+  def get(self, path, data=None, alt_token=False, attempt=1, wait=None):
+    if wait is None:
+      wait = self.rate_limit_wait
+    # spread default traffic over the default and alt apps by remaining budget
+    if alt_token == False and attempt == 1 and rate_limiter.most_available([self.client_id, self.alt_client_id]) == self.alt_client_id:
+      alt_token = 'alt'
+    client_id, client_secret = self.credentials(alt_token)
+    bucket = rate_limiter.bucket(client_id)
+    if not bucket.acquire(wait, RATE_LIMIT_MAX_WAIT):
+      print("Spotify rate limit budget exhausted: " + (alt_token if alt_token else 'default'))
+      raise ErrorResponse({"error": "Spotify rate limit budget exhausted"}, 299, "Spotify")
+    # the shared store hands back its cached token, renewing it just before it expires
+    token = self.authorize(alt_token=alt_token)
     print("Spotify Request: " + path + ' ' + (alt_token if alt_token else 'default'))
-    res = requests.get(f"{self.root_uri}{path}", headers= {
-      "Authorization": f"Bearer {self.alt_token if alt_token == 'alt' else (self.user_token if alt_token == 'user' else self.access_token)}"
+    res = session_for(self.root_uri).get(f"{self.root_uri}{path}", headers= {
+      "Authorization": f"Bearer {token}"
     }, params=data)
 
     # error handling
@@ -77,19 +152,22 @@ class SpotifyClient():
       if res.status_code == 401:
         before = self.alt_token if alt_token == 'alt' else ( self.user_token if alt_token == 'user' else self.access_token)
         print("Spotify Access Token Expired, Refreshing")
-        self.authorize(alt_token)
+        self.authorize(alt_token, force=True)
         # If it worked, retry
         if (alt_token == 'alt' and self.alt_token != before) or (self.access_token != before and alt_token == False) or (self.user_token != before and alt_token == 'user'):
-          return self.get(path, data, alt_token=alt_token)
+          return self.get(path, data, alt_token=alt_token, attempt=attempt, wait=wait)
 
-      # Catch rate limits and switch to a 299 so the task doesn't restart
+      # Catch rate limits, park the credential until Retry-After and switch to a 299 so the task doesn't restart
       if res.status_code == 429:
-        print("Spotify Rate Limiting")
-        if 'retry-after' in res.headers:
-          print(f"Retry After: {res.headers['retry-after']}")
+        retry_after = parse_retry_after(res.headers.get('retry-after'))
+        print(f"Spotify Rate Limiting, Retry After: {retry_after}")
+        bucket.block_for(retry_after)
         if attempt == 1:
           print("trying with opposite token")
-          return self.get(path, data, alt_token=('alt' if alt_token == False else False), attempt=attempt + 1)
+          return self.get(path, data, alt_token=('alt' if alt_token == False else False), attempt=attempt + 1, wait=wait)
+        if wait and attempt < RATE_LIMIT_MAX_ATTEMPTS and retry_after <= RATE_LIMIT_MAX_WAIT:
+          print("waiting out the rate limit")
+          return self.get(path, data, alt_token=alt_token, attempt=attempt + 1, wait=wait)
         raise ErrorResponse({"error":res.text}, 299, "Spotify")
       
       # Throw back the errors
@@ -119,23 +197,63 @@ class SpotifyClient():
   def get_artists(self, ids, alt_token=False):
     return self.get_cached(ids, 'artist', timedelta(days=1), alt_token)
   
-  def get_playlist(self, id, alt_token=False):
-    playlist = self.get_cached(id, 'playlist', timedelta(minutes=10), data="?fields=name,images,description,collaborative,public,owner,id,tracks(total,limit,next,items(track(name,artists(id,name,type)))", alt_token=alt_token)
+  def get_playlist(self, id, alt_token=False, parallel_pages=True):
+    playlist = self.get_memory_cached(id, 'playlist', PLAYLIST_TTL)
+    if playlist is not None:
+      return playlist
+
+    # a stale but complete cached copy is still good if the playlist's snapshot hasn't moved
+    cache_doc = self.get_cache_doc(id, 'playlist')
+    if cache_doc is not None:
+      cached = cache_doc.get('data')
+      created_at = cache_doc.get('created_at')
+      complete = len(cached['tracks']['items']) >= cached['tracks']['total']
+      fresh = created_at is not None and created_at > datetime.now(created_at.tzinfo) - PLAYLIST_TTL
+      if complete and (fresh or (cached.get('snapshot_id') is not None and self.get_playlist_snapshot_id(id, alt_token) == cached.get('snapshot_id'))):
+        if not fresh:
+          print("Playlist snapshot unchanged, reusing cached tracks: " + id)
+          self.cache_writer.update(cache_doc.reference, {"created_at": SERVER_TIMESTAMP})
+          self.flush_cache_writes()
+        self.set_memory_cached(id, 'playlist', cached)
+        return cached
+
+    playlist = self.get('/playlists/' + id + '?fields=' + PLAYLIST_FIELDS, data={}, alt_token=alt_token)
     if len(playlist['tracks']['items']) < playlist['tracks']['total']:
-      current_track_page = playlist['tracks']
-      while current_track_page['next']:
-        current_track_page = self.get('/playlists/' + id+'/tracks?fields=total,limit,next,items(track(name,artists(id,name,type))&' + current_track_page['next'].split('?')[1], data={}, alt_token=alt_token)
-        playlist['tracks']['items'].extend(current_track_page['items'])
-      if len(playlist['tracks']['items']) == playlist['tracks']['total']:
-        check_cache = self.db.collection("spotify_cache").where(filter=FieldFilter(
-          "spotify_id", "==", id
-        )).where(filter=FieldFilter(
-          'type', '==', 'playlist'
-        )).get().pop()
-        check_cache.reference.update({"data": playlist, "spotify_id": id, "type": "playlist", "created_at": SERVER_TIMESTAMP})
+      if parallel_pages and playlist['tracks'].get('limit'):
+        playlist['tracks']['items'].extend(self.get_playlist_track_pages(id, playlist['tracks'], alt_token))
+      else:
+        current_track_page = playlist['tracks']
+        while current_track_page['next']:
+          current_track_page = self.get('/playlists/' + id+'/tracks?fields=total,limit,next,items(track(name,artists(id,name,type))&' + current_track_page['next'].split('?')[1], data={}, alt_token=alt_token)
+          playlist['tracks']['items'].extend(current_track_page['items'])
+    cache_ref = cache_doc.reference if cache_doc is not None else self.cache_doc_ref(id, 'playlist')
+    self.cache_writer.set(cache_ref, {"data": playlist, "spotify_id": id, "type": "playlist", "created_at": SERVER_TIMESTAMP})
+    self.flush_cache_writes()
+    self.set_memory_cached(id, 'playlist', playlist)
 
     return playlist
 
+  def get_playlist_snapshot_id(self, id, alt_token=False):
+    return self.get('/playlists/' + id + '?fields=snapshot_id', data={}, alt_token=alt_token).get('snapshot_id')
+
+  def get_playlist_track_pages(self, id, first_page: dict, alt_token=False):
+    """
+    Fetch every track page after the first one concurrently.
+    The first page carries total and limit, so all remaining offsets are known up front.
+
+    Returns:
+        list: the remaining track items, in playlist order
+    """
+    limit = first_page['limit']
+    offsets = list(range(len(first_page['items']), first_page['total'], limit))
+
+    def fetch_page(offset):
+      page = self.get('/playlists/' + id + '/tracks?fields=total,limit,next,items(track(name,artists(id,name,type))&offset=' + str(offset) + '&limit=' + str(limit), data={}, alt_token=alt_token)
+      return page['items']
+
+    pages = map_concurrently(fetch_page, offsets, PLAYLIST_PAGE_WORKERS)
+    return [item for page in pages for item in page]
+
   def trim_link_id(self, url):
     return url.split('/')[-1]
 
@@ -158,23 +276,51 @@ class SpotifyClient():
     return plines
   
   def get_artist_recent_plines_with_dates(self, id):
-    album_page = self.get_artist_albums(id)
-    if len(album_page['items']) == 0:
-      return []
-    ids = []
-    for a in album_page['items']:
-      ids.append(a['id'])
+    return self.get_artists_recent_plines_with_dates([id])[id]
 
-    ids = ids[:4]
-    albums = self.get_albums(ids)
-    plines=[]
-    for album in albums:
-      copyrights = album['copyrights']
-      for c in copyrights:
-        if c['type'] == 'P':
-          plines.append({'line': c['text'], 'date': album['release_date']})
+  def get_artists_recent_plines_with_dates(self, ids: list, albums_per_artist: int = 4, ignore_errors=False):
+    """
+    Recent P lines for many artists at once. Album lists are still per artist, but the albums
+    themselves are fetched together so the 20 id /albums batches are shared across artists.
+
+    Returns:
+        dict: spotify artist id -> list of {'line', 'date'}, newest albums first.
+        With ignore_errors, artists whose album list couldn't be fetched are left out.
+    """
+    def album_ids_for(id):
+      try:
+        album_page = self.get_artist_albums(id)
+      except ErrorResponse as e:
+        if not ignore_errors:
+          raise e
+        print("Skipping p lines for " + id + ": " + str(e.data))
+        return None
+      return [a['id'] for a in album_page['items']][:albums_per_artist]
+
+    ids = list(dict.fromkeys(ids))
+    album_ids_by_artist = {}
+    for id, album_ids in zip(ids, map_concurrently(album_ids_for, ids, FETCH_WORKERS)):
+      if album_ids is not None:
+        album_ids_by_artist[id] = album_ids
+
+    all_album_ids = list(dict.fromkeys(album_id for album_ids in album_ids_by_artist.values() for album_id in album_ids))
+    albums_by_id = {}
+    if len(all_album_ids) > 0:
+      for album in self.get_albums(all_album_ids):
+        albums_by_id[album['id']] = album
+
+    plines = {}
+    for id, album_ids in album_ids_by_artist.items():
+      plines[id] = []
+      for album_id in album_ids:
+        album = albums_by_id.get(album_id)
+        if album is None:
+          continue
+        for c in album['copyrights']:
+          if c['type'] == 'P':
+            plines[id].append({'line': c['text'], 'date': album['release_date']})
     return plines
-  
+
   def get_playlist_artists(self, id, alt_token=False):
     p = self.get_playlist(id, alt_token=alt_token)
     artist_ids = []
@@ -263,7 +409,7 @@ class SpotifyClient():
     existing = sql_session.scalars(select(SpotifyToken).where(and_(SpotifyToken.state == state, SpotifyToken.client_id == client_id))).first()
     if existing is not None:
       return existing.as_dict()
-    res = requests.post("https://accounts.spotify.com/api/token", headers= {
+    res = session_for(SPOTIFY_TOKEN_URI).post(SPOTIFY_TOKEN_URI, headers= {
       "Authorization": f"{self.encode_client_credentials(client_id, self.alt_client_secret)}",
       'Content-Type': 'application/x-www-form-urlencoded',
       "Accept": "application/json"
@@ -308,8 +454,35 @@ class SpotifyClient():
     """
     for i in range(0, len(input_list), chunk_size):
       yield input_list[i:i + chunk_size]
+  def cache_doc_id(self, spotify_id: str, object_type: str):
+    return object_type + ":" + spotify_id
+
+  def cache_doc_ref(self, spotify_id: str, object_type: str):
+    """
+    Reference a new or existing spotify_cache document for the configured layout.
+    The keyed layout has one document per object ({type}:{spotify_id}), the query layout uses auto IDs.
+    """
+    if self.cache_layout == 'keyed':
+      return self.db.collection("spotify_cache").document(self.cache_doc_id(spotify_id, object_type))
+    return self.db.collection("spotify_cache").document()
+
+  def get_cache_doc(self, spotify_id: str, object_type: str):
+    """
+    Get the newest spotify_cache snapshot for an object, or None if it isn't cached.
+    """
+    cached = self.get_cached_objects([spotify_id], object_type)
+    return cached[0] if len(cached) > 0 else None
+
   def get_cached_objects(self, ids: list, object_type: str):
     objects = []
+    if self.cache_layout == 'keyed':
+      refs = [self.cache_doc_ref(id, object_type) for id in ids]
+      for ref_chunk in self.chunk_list(refs, 100):
+        for snapshot in self.db.get_all(ref_chunk):
+          if snapshot.exists:
+            objects.append(snapshot)
+      return objects
+
     id_chunks = self.chunk_list(ids, 30)
     for ids_search in id_chunks:
       check_cache = self.db.collection("spotify_cache").where(filter=FieldFilter(
@@ -325,57 +498,157 @@ class SpotifyClient():
   def get_cached(self, ids: list|str, object_type: str, expires_delta: timedelta|None  = timedelta(hours=1), alt_token = False, data: dict|str = None):
     if data is None:
       data = {}
-    path = object_type+"s"
-    if object_type in ['top-tracks', 'albums-artist']:
-      if isinstance(ids, list):
-        raise Exception('sub item caches must be done one id at a time (no list)')
-      path = 'artists/'+ids+'/'+object_type.split('-artist')[0]
-    elif isinstance(ids, str):
-      path = path + "/" + ids
-    elif len(ids) == 1:
-      path = path + "/" + ids[0]
+    if object_type in ['top-tracks', 'albums-artist'] and isinstance(ids, list):
+      raise Exception('sub item caches must be done one id at a time (no list)')
     ids_search = ids
     if isinstance(ids, str):
       ids_search = [ids]
-    check_cache = self.get_cached_objects(ids_search, object_type)
-    object_data = []
-    missing_ids = []
+    found = {}
+    firestore_ids = []
     for id in ids_search:
-      found = False
-      for check in check_cache:
-        if check.get('spotify_id') == id and (expires_delta is None or check.get('created_at') > datetime.now(check.get('created_at').tzinfo) - expires_delta):
-          found = True
-          object_data.append(check.get('data'))
-      if found == False:
+      # ids that recently came back invalid/missing fail fast (single lookups) or are left out (lists)
+      negative_key = negative_cache.key('Spotify', object_type, id)
+      if isinstance(ids, str):
+        negative_cache.check(negative_key)
+      elif negative_cache.get(negative_key) is not None:
+        continue
+      memory_hit = self.get_memory_cached(id, object_type, expires_delta)
+      if memory_hit is not None:
+        found[id] = memory_hit
+      elif id not in firestore_ids:
+        firestore_ids.append(id)
+    check_cache = self.get_cached_objects(firestore_ids, object_type) if len(firestore_ids) > 0 else []
+    # newest document per id (query results are ordered by created_at desc)
+    cached_by_id = {}
+    for check in check_cache:
+      if check.get('spotify_id') not in cached_by_id:
+        cached_by_id[check.get('spotify_id')] = check
+    missing_ids = []
+    for id in firestore_ids:
+      check = cached_by_id.get(id)
+      if check is not None and (expires_delta is None or check.get('created_at') > datetime.now(check.get('created_at').tzinfo) - expires_delta):
+        found[id] = check.get('data')
+        self.set_memory_cached(id, object_type, check.get('data'), check.get('created_at'))
+      else:
         missing_ids.append(id)
-    print(str(len(object_data)) + " cached found " + str(len(missing_ids)) + " ids needed " + (str(len(ids)) if isinstance(ids, list) else "1") + " given")
+    print(str(len(found)) + " cached found " + str(len(missing_ids)) + " ids needed " + (str(len(ids)) if isinstance(ids, list) else "1") + " given")
     if len(missing_ids) > 0:
-      if len(missing_ids) == 1:
-        if len(ids_search) > 1:
-          path = path + "/" + missing_ids[0]
-        objects = {object_type+"s": [self.get(f"/" + path+(data if isinstance(data, str) else ""), data=data, alt_token=alt_token)]}
-      else:
-        idp = ",".join(id for id in missing_ids)
-        data['ids'] = idp
-        objects = self.get(f"/"+path+(data if isinstance(data, str) else ""), data=data, alt_token=alt_token)
-      for object_item in objects[object_type+"s"] if (object_type+"s") in objects else []:
-        if 'id' not in object_item and isinstance(ids, str):
-          object_item['id'] = ids
-        object_data.append(object_item)
-        existing = False
-        for check in check_cache:
-          if check.get('spotify_id') == object_item['id']:
-            existing = check
-            break
-        if existing:
-          existing.reference.set({"id": existing.id, "data": object_item, "created_at": SERVER_TIMESTAMP, "type": object_type, "spotify_id": object_item['id']})
-          print("Updated "+object_type+" in cache: " + str(object_item['id']))
+      try:
+        fetched = self.fetch_objects(missing_ids, object_type, alt_token=alt_token, data=data)
+      except ErrorResponse as e:
+        # a multi-get failure can't be pinned on one id, so only single lookups are remembered
+        if len(missing_ids) == 1:
+          negative_cache.record(negative_cache.key('Spotify', object_type, missing_ids[0]), e)
+        raise e
+      fetched_ids = set(requested_id for requested_id, _ in fetched)
+      for id in missing_ids:
+        if id not in fetched_ids:
+          negative_cache.record(negative_cache.key('Spotify', object_type, id), ErrorResponse({"error": "Spotify returned null for " + id}, 404, "Spotify"))
+      for requested_id, object_item in fetched:
+        if 'id' not in object_item:
+          object_item['id'] = requested_id
+        found[requested_id] = object_item
+        self.set_memory_cached(object_item['id'], object_type, object_item)
+        existing = cached_by_id.get(object_item['id'])
+        if self.cache_layout == 'keyed':
+          self.cache_writer.set(self.cache_doc_ref(object_item['id'], object_type), {"data": object_item, "created_at": SERVER_TIMESTAMP, "type": object_type, "spotify_id": object_item['id']})
+        elif existing:
+          self.cache_writer.set(existing.reference, {"id": existing.id, "data": object_item, "created_at": SERVER_TIMESTAMP, "type": object_type, "spotify_id": object_item['id']})
         else:
           cache = {"data": object_item, "spotify_id": object_item.get('id'), "type": object_type, "created_at": SERVER_TIMESTAMP}
-          update_time, cache_ref = self.db.collection("spotify_cache").add(cache)
-          print(f"Added cache with id {str(cache_ref.id)}: " + str(object_item.get('id')))
+          self.cache_writer.set(self.db.collection("spotify_cache").document(), cache)
+      print("Queued " + str(self.cache_writer.pending()) + " " + object_type + " cache write(s)")
+      self.flush_cache_writes()
+    # merge hits and fetches back into the order they were asked for
+    object_data = [found[id] for id in ids_search if id in found]
     return object_data if isinstance(ids, list) else object_data[0]
 
+  def object_path(self, id: str, object_type: str):
+    if object_type in ['top-tracks', 'albums-artist']:
+      return 'artists/'+id+'/'+object_type.split('-artist')[0]
+    return object_type + "s/" + id
+
+  def fetch_objects(self, ids: list, object_type: str, alt_token = False, data: dict|str = None):
+    """
+    Fetch objects from the API, splitting multi-gets into batches the endpoint accepts and running
+    the batches on a small thread pool.
+
+    Returns:
+        list: (requested id, object) pairs in input order. Ids Spotify returns null for are left out.
+    """
+    if data is None:
+      data = {}
+
+    def fetch_one(id):
+      return [(id, self.get("/" + self.object_path(id, object_type) + (data if isinstance(data, str) else ""), data=data, alt_token=alt_token))]
+
+    def fetch_batch(batch):
+      if len(batch) == 1:
+        return fetch_one(batch[0])
+      params = dict(data)
+      params['ids'] = ",".join(batch)
+      res = self.get("/" + object_type + "s", data=params, alt_token=alt_token)
+      return list(zip(batch, res.get(object_type + "s", [])))
+
+    if object_type in MULTI_GET_LIMITS and isinstance(data, dict):
+      results = map_concurrently(fetch_batch, list(self.chunk_list(ids, MULTI_GET_LIMITS[object_type])), FETCH_WORKERS)
+    else:
+      results = map_concurrently(fetch_one, ids, FETCH_WORKERS)
+    return [pair for batch in results for pair in batch if pair[1] is not None]
+
+  def get_memory_cached(self, spotify_id: str, object_type: str, max_age: timedelta|None = None):
+    cache = MEMORY_CACHES.get(object_type)
+    if cache is None:
+      return None
+    cached = cache.get(spotify_id, max_age)
+    # hand out copies, callers (eg. get_playlist) extend the objects they get back
+    return copy.deepcopy(cached) if cached is not None else None
+
+  def set_memory_cached(self, spotify_id: str, object_type: str, data, cached_at: datetime|None = None):
+    cache = MEMORY_CACHES.get(object_type)
+    if cache is None or spotify_id is None or data is None:
+      return
+    if cached_at is not None and cached_at.tzinfo is not None:
+      cached_at = cached_at.astimezone().replace(tzinfo=None)
+    data = self.memory_cache_trim(object_type, data)
+    cache.set(spotify_id, data, cached_at=cached_at, size=len(json.dumps(data, default=str)))
+
+  def memory_cache_trim(self, object_type: str, data: dict):
+    """
+    A copy of data with only the MEMORY_CACHE_FIELDS of object_type (all of them if it has none).
+    """
+    fields = MEMORY_CACHE_FIELDS.get(object_type)
+    if fields is None:
+      return copy.deepcopy(data)
+    trimmed = {field: copy.deepcopy(data[field]) for field in fields if field in data}
+    item_fields = MEMORY_CACHE_ITEM_FIELDS.get(object_type)
+    if item_fields is not None and isinstance(trimmed.get('items'), list):
+      trimmed['items'] = [{field: item[field] for field in item_fields if field in item} for item in trimmed['items'] if item is not None]
+    return trimmed
+
+  @contextmanager
+  def deferred_cache_writes(self):
+    """
+    Hold spotify_cache writes until the end of the block (eg. a request) and commit them in batches.
+    """
+    self.defer_cache_writes = True
+    try:
+      yield self
+    finally:
+      self.defer_cache_writes = False
+      self.flush_cache_writes()
+
+  def flush_cache_writes(self):
+    if self.defer_cache_writes:
+      return
+    self.cache_writer.flush()
+
+  def memory_cache_stats(self):
+    return {object_type: cache.stats() for object_type, cache in MEMORY_CACHES.items()}
+
+  def negative_cache_stats(self):
+    return negative_cache.stats()
+
   def encode_client_credentials(self, client_id, client_secret):
     credentials = f"{client_id}:{client_secret}"
     credentials_bytes = credentials.encode('ascii')
@@ -0,0 +1,106 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, and_
+
+from .models import SpotifyToken
+
+# state marker for client credentials tokens in spotify_tokens (user auth rows carry an oauth state)
+APP_TOKEN_STATE = 'client_credentials'
+
+
+def utc_now():
+  return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class SpotifyTokenStore():
+  """
+  Access token cache keyed by client ID, shared by every SpotifyClient in the process.
+
+  Tokens are treated as expired refresh_margin before Spotify expires them, so they are renewed
+  proactively instead of on a 401. When a session_factory is given, tokens are also persisted to
+  the spotify_tokens table so a cold instance can reuse a token another instance fetched.
+  """
+  def __init__(self, session_factory=None, refresh_margin: timedelta = timedelta(seconds=60)):
+    self.session_factory = session_factory
+    self.refresh_margin = refresh_margin
+    self.tokens = {}
+    self.locks = {}
+    self.lock = threading.Lock()
+
+  def get_token(self, client_id: str, fetch, force=False):
+    """
+    Get a live token for client_id, calling fetch() -> (token, expires_in) when none is cached.
+    Returns None when the token endpoint refused the credentials.
+    """
+    with self.__client_lock(client_id):
+      if not force:
+        token = self.__live(self.tokens.get(client_id))
+        if token is not None:
+          return token
+        stored = self.__load(client_id)
+        token = self.__live(stored)
+        if token is not None:
+          self.tokens[client_id] = stored
+          return token
+
+      fetched = fetch()
+      if fetched is None:
+        self.tokens.pop(client_id, None)
+        return None
+      token, expires_in = fetched
+      entry = (token, utc_now() + timedelta(seconds=int(expires_in)))
+      self.tokens[client_id] = entry
+      self.__save(client_id, entry)
+      return token
+
+  def __live(self, entry):
+    if entry is None:
+      return None
+    token, expires_at = entry
+    if expires_at - self.refresh_margin <= utc_now():
+      return None
+    return token
+
+  def __client_lock(self, client_id):
+    with self.lock:
+      if client_id not in self.locks:
+        self.locks[client_id] = threading.Lock()
+      return self.locks[client_id]
+
+  def __load(self, client_id):
+    if self.session_factory is None:
+      return None
+    session = self.session_factory()
+    try:
+      record = session.scalars(select(SpotifyToken).where(and_(SpotifyToken.client_id == client_id, SpotifyToken.state == APP_TOKEN_STATE)).order_by(SpotifyToken.expires_at.desc())).first()
+      return (record.token, record.expires_at) if record is not None else None
+    except Exception as e:
+      print(f"[spotify_tokens] load error: {e}")
+      return None
+    finally:
+      session.close()
+
+  def __save(self, client_id, entry):
+    if self.session_factory is None:
+      return
+    token, expires_at = entry
+    session = self.session_factory()
+    try:
+      record = session.scalars(select(SpotifyToken).where(and_(SpotifyToken.client_id == client_id, SpotifyToken.state == APP_TOKEN_STATE))).first()
+      if record is None:
+        record = SpotifyToken(client_id=client_id, state=APP_TOKEN_STATE)
+      record.token = token
+      record.expires_at = expires_at
+      record.created_at = utc_now()
+      session.add(record)
+      session.commit()
+    except Exception as e:
+      session.rollback()
+      print(f"[spotify_tokens] save error: {e}")
+    finally:
+      session.close()
+
+
+# in-process only store used when a client isn't given one
+shared_token_store = SpotifyTokenStore()
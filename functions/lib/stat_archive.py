@@ -0,0 +1,151 @@
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, text, and_
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import StatisticArchive
+
+# rows per INSERT statement, well under postgres' bind parameter limit
+ARCHIVE_INSERT_CHUNK = 1000
+
+# partitions already created by this instance
+ensured_partitions = set()
+ensured_partitions_lock = threading.Lock()
+
+
+def partition_name(month: date):
+  return f"statistic_archive_{month.year:04d}_{month.month:02d}"
+
+
+def month_start(day: date):
+  return date(day.year, day.month, 1)
+
+
+def next_month(month: date):
+  return date(month.year + 1, 1, 1) if month.month == 12 else date(month.year, month.month + 1, 1)
+
+
+def ensure_partitions(sql_session, first: date, last: date):
+  """
+  Create the monthly partitions covering first..last if they don't exist yet.
+
+  The DDL runs on its own autocommit connection, so a rollback of the caller's transaction can't undo
+  a partition this instance already counts as created.
+  """
+  month = month_start(first)
+  while month <= last:
+    name = partition_name(month)
+    with ensured_partitions_lock:
+      known = name in ensured_partitions
+    if not known:
+      create_partition(sql_session.get_bind(), name, month)
+      with ensured_partitions_lock:
+        ensured_partitions.add(name)
+    month = next_month(month)
+
+
+def create_partition(engine, name: str, month: date):
+  with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+    try:
+      connection.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "statistic_archive" '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+      ))
+    except Exception:
+      # IF NOT EXISTS can still lose a race with another instance creating the same partition
+      if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+        raise
+
+
+def archive_statistics(sql_session, rows: list, commit=True):
+  """
+  Bulk upsert daily values into the archive. rows are dicts of artist_id, statistic_type_id, date, value.
+
+  History is never deleted; a value only changes when the same day is archived again with a different
+  value (songstats can revise the most recent day).
+  """
+  if len(rows) == 0:
+    return 0
+  ensure_partitions(sql_session, min(row['date'] for row in rows), max(row['date'] for row in rows))
+  for i in range(0, len(rows), ARCHIVE_INSERT_CHUNK):
+    stmt = insert(StatisticArchive).values(rows[i:i + ARCHIVE_INSERT_CHUNK])
+    stmt = stmt.on_conflict_do_update(
+      index_elements=['artist_id', 'statistic_type_id', 'date'],
+      set_={'value': stmt.excluded.value},
+      where=StatisticArchive.value.is_distinct_from(stmt.excluded.value)
+    )
+    sql_session.execute(stmt)
+  if commit:
+    sql_session.commit()
+  return len(rows)
+
+
+def archive_rows(artist_id, statistic_type_id: int, as_of: list, values: list):
+  """
+  Archive rows for one stat series, as_of being the 'YYYY-MM-DD' dates the values line up with.
+  """
+  return [{
+    'artist_id': artist_id,
+    'statistic_type_id': statistic_type_id,
+    'date': datetime.strptime(day, '%Y-%m-%d').date(),
+    'value': value,
+  } for day, value in zip(as_of, values)]
+
+
+def load_archived_series(sql_session, artist_id, days: int, end: date = None, statistic_type_ids: list = None):
+  """
+  Archived values for an artist over the `days` days up to end (default today), one entry per day
+  with gaps carried forward from the previous day.
+
+  Returns:
+      dict: statistic_type_id -> (dates, values), dates as 'YYYY-MM-DD' strings
+  """
+  end = end if end is not None else date.today()
+  start = end - timedelta(days=days)
+  filters = [StatisticArchive.artist_id == artist_id, StatisticArchive.date >= start, StatisticArchive.date <= end]
+  if statistic_type_ids is not None:
+    filters.append(StatisticArchive.statistic_type_id.in_(statistic_type_ids))
+  rows = sql_session.execute(
+    select(StatisticArchive.statistic_type_id, StatisticArchive.date, StatisticArchive.value)
+      .where(and_(*filters))
+      .order_by(StatisticArchive.statistic_type_id, StatisticArchive.date)
+  ).all()
+
+  by_type = {}
+  for statistic_type_id, day, value in rows:
+    by_type.setdefault(statistic_type_id, {})[day] = value
+
+  series = {}
+  for statistic_type_id, values_by_day in by_type.items():
+    day = min(values_by_day)
+    last = max(values_by_day)
+    dates = []
+    values = []
+    while day <= last:
+      dates.append(day.isoformat())
+      values.append(values_by_day[day] if day in values_by_day else values[-1])
+      day += timedelta(days=1)
+    series[statistic_type_id] = (dates, values)
+  return series
+
+
+# Statistic Archive Table SQL
+#
+# -- CreateTable
+# CREATE TABLE "statistic_archive" (
+#     "artist_id" UUID NOT NULL,
+#     "statistic_type_id" INTEGER NOT NULL,
+#     "date" DATE NOT NULL,
+#     "value" DOUBLE PRECISION NOT NULL,
+#     "created_at" TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+#
+#     CONSTRAINT "statistic_archive_pkey" PRIMARY KEY ("artist_id", "statistic_type_id", "date")
+# ) PARTITION BY RANGE ("date");
+#
+# -- Monthly partitions are created on demand by ensure_partitions, eg.
+# -- CREATE TABLE "statistic_archive_2025_01" PARTITION OF "statistic_archive" FOR VALUES FROM ('2025-01-01') TO ('2025-02-01');
+#
+# -- AddForeignKey
+# ALTER TABLE "statistic_archive" ADD CONSTRAINT "statistic_archive_artist_id_fkey" FOREIGN KEY ("artist_id") REFERENCES "artists"("id") ON DELETE CASCADE ON UPDATE NO ACTION;
+# ALTER TABLE "statistic_archive" ADD CONSTRAINT "statistic_archive_statistic_type_id_fkey" FOREIGN KEY ("statistic_type_id") REFERENCES "statistic_types"("id") ON DELETE RESTRICT ON UPDATE NO ACTION;
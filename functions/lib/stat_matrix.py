@@ -0,0 +1,110 @@
+import numpy as np
+
+ISO_DATE_LENGTH = len('YYYY-MM-DD')
+
+
+class UnsupportedHistory(Exception):
+  """
+  Raised for history shapes the fast path doesn't reproduce exactly; callers fall back to pandas.
+  """
+
+
+def merge_histories_daily(stats: list):
+  """
+  Merge each source's daily `history` into one date x column int64 matrix.
+
+  Mirrors pd.concat(axis=1) of per-source frames followed by ffill().bfill().fillna(0).astype(int):
+  columns are "{source}__{field}" in order of first appearance, and dates keep their order when
+  every source reports the same dates, otherwise they are the sorted union.
+
+  Returns:
+      tuple: (dates, columns, matrix) or None when no source has history
+  """
+  merged = merge_histories(stats)
+  if merged is None:
+    return None
+  dates, columns, matrix = merged
+  return dates, columns, fill_gaps(matrix).astype(np.int64)
+
+
+def merge_histories(stats: list):
+  """
+  merge_histories_daily without the gap filling: missing values are left as NaN.
+  """
+  sources = []
+  for stat in stats:
+    if 'data' not in stat or 'history' not in stat['data']:
+      continue
+    history = stat['data']['history']
+    if len(history) == 0:
+      continue
+    sources.append((stat['source'], history))
+  if len(sources) == 0:
+    return None
+
+  source_dates = []
+  for _, history in sources:
+    dates = [record['date'] for record in history]
+    if any(not isinstance(d, str) or len(d) != ISO_DATE_LENGTH for d in dates) or len(set(dates)) != len(dates):
+      raise UnsupportedHistory('dates must be unique YYYY-MM-DD strings')
+    source_dates.append(dates)
+
+  if all(dates == source_dates[0] for dates in source_dates):
+    all_dates = source_dates[0]
+  else:
+    all_dates = sorted(set(d for dates in source_dates for d in dates))
+  row_index = {d: i for i, d in enumerate(all_dates)}
+
+  columns = []
+  column_index = {}
+  for source, history in sources:
+    for record in history:
+      for field in record:
+        if field == 'date':
+          continue
+        name = f"{source}__{field}"
+        if name not in column_index:
+          column_index[name] = len(columns)
+          columns.append(name)
+
+  matrix = np.full((len(all_dates), len(columns)), np.nan)
+  for source, history in sources:
+    for record in history:
+      row = row_index[record['date']]
+      for field, value in record.items():
+        if field == 'date' or value is None:
+          continue
+        if not isinstance(value, (int, float)):
+          raise UnsupportedHistory(f"non numeric value for {source}__{field}")
+        matrix[row, column_index[f"{source}__{field}"]] = value
+
+  return all_dates, columns, matrix
+
+
+def fill_gaps(matrix, seed=None):
+  """
+  Forward fill then back fill NaNs down each column, leaving 0 where a column has no values.
+  A seed row (the last known values before the first row) is used to forward fill the start.
+  """
+  if seed is not None:
+    matrix = np.vstack([np.asarray(seed, dtype=float).reshape(1, -1), matrix])
+  if matrix.size > 0:
+    rows = np.arange(matrix.shape[0])[:, None]
+    cols = np.arange(matrix.shape[1])[None, :]
+    # index of the last non-NaN row at or above each cell
+    last = np.maximum.accumulate(np.where(np.isnan(matrix), 0, rows), axis=0)
+    matrix = matrix[last, cols]
+    # and of the next non-NaN row at or below, for the leading gaps
+    reversed_rows = matrix[::-1]
+    following = np.maximum.accumulate(np.where(np.isnan(reversed_rows), 0, rows), axis=0)
+    matrix = reversed_rows[following, cols][::-1]
+  if seed is not None:
+    matrix = matrix[1:]
+  return np.nan_to_num(matrix, nan=0.0)
+
+
+def matrix_to_dict(columns: list, matrix):
+  """
+  Column name -> list of python ints, the shape DataFrame.to_dict(orient='list') produces.
+  """
+  return {name: values for name, values in zip(columns, matrix.T.tolist())}
@@ -0,0 +1,61 @@
+# offsets back from the latest value: previous day, week and month (28 days)
+DAY_OFFSET = 2
+WEEK_OFFSET = 8
+MONTH_OFFSET = 29
+
+
+class StatisticRollup():
+  """
+  Derived metrics for every stat series of an artist, computed together so they can be written
+  in one go (see StatisticsWriter).
+
+  The field -> StatisticType map is built once up front, so refreshes don't rescan the types per field.
+  """
+  def __init__(self, statistic_types: list, fields: list):
+    self.types_by_id = {statistic_type.id: statistic_type for statistic_type in statistic_types}
+    self.types_by_field = {}
+    for field in fields:
+      self.types_by_field[field] = self.__match_field(statistic_types, field)
+
+  def type_for_field(self, field: str):
+    if field not in self.types_by_field:
+      self.types_by_field[field] = self.__match_field(self.types_by_id.values(), field)
+    return self.types_by_field[field]
+
+  def compute(self, series: dict):
+    """
+    series maps statistic_type_id -> values (oldest first). Empty series are skipped.
+
+    Returns:
+        dict: statistic_type_id -> Statistic column values, as add_or_update_sql_stat computed them
+        (int format types are truncated to ints)
+    """
+    metrics = {}
+    for type_id, values in series.items():
+      if values is None or len(values) == 0:
+        continue
+      value_set = list(map(int if self.types_by_id[type_id].format == 'int' else float, values))
+      length = len(value_set)
+      # same (possibly negative) positions the list indexing always used
+      latest = value_set[length - 1]
+      previous_day = value_set[length - DAY_OFFSET]
+      previous_week = value_set[length - WEEK_OFFSET]
+      previous_month = value_set[length - MONTH_OFFSET]
+      metrics[type_id] = {
+        'latest': latest,
+        'previous': previous_week,
+        'max': max(value_set),
+        'min': min(value_set),
+        'avg': sum(value_set) / length,
+        'data': value_set,
+        'day_over_day': 0 if previous_day <= 0 else (latest - previous_day) / previous_day,
+        'week_over_week': 0 if previous_week <= 0 else (latest - previous_week) / previous_week,
+        'month_over_month': 0 if previous_month <= 0 else (latest - previous_month) / previous_month,
+      }
+    return metrics
+
+  def __match_field(self, statistic_types, field: str):
+    for statistic_type in statistic_types:
+      if field.startswith(statistic_type.source + '__' + statistic_type.key):
+        return statistic_type
+    return None
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import Statistic
+
+# rows per statement; 14 bind parameters a row keeps this far below postgres' limit
+STATISTICS_UPSERT_CHUNK = 1000
+
+UPSERT_COLUMNS = ['latest', 'previous', 'max', 'min', 'avg', 'data', 'day_over_day', 'week_over_week',
+                  'month_over_month', 'last_date', 'updated_at']
+
+
+class StatisticsWriter():
+  """
+  Collects Statistic rows for any number of artists and writes them with one
+  INSERT ... ON CONFLICT (artist_id, statistic_type_id) DO UPDATE per batch, instead of an
+  ORM UPDATE/INSERT per row.
+  """
+  def __init__(self, chunk_size: int = STATISTICS_UPSERT_CHUNK):
+    self.chunk_size = chunk_size
+    self.rows = {}
+
+  def add(self, artist_id, metrics: dict, last_date):
+    """
+    Queue the StatisticRollup.compute() output for an artist. A later add for the same artist and
+    type replaces the earlier one.
+    """
+    if isinstance(last_date, str):
+      last_date = datetime.strptime(last_date, '%Y-%m-%d')
+    now = datetime.now()
+    for statistic_type_id, values in metrics.items():
+      row = dict(values)
+      row.update({
+        'artist_id': artist_id,
+        'statistic_type_id': statistic_type_id,
+        'last_date': last_date,
+        'created_at': now,
+        'updated_at': now,
+      })
+      self.rows[(artist_id, statistic_type_id)] = row
+
+  def pending(self):
+    return len(self.rows)
+
+  def flush(self, sql_session, commit=False):
+    """
+    Write everything queued. Returns the number of rows written.
+    """
+    rows = list(self.rows.values())
+    self.rows = {}
+    for i in range(0, len(rows), self.chunk_size):
+      stmt = insert(Statistic).values(rows[i:i + self.chunk_size])
+      stmt = stmt.on_conflict_do_update(
+        index_elements=['artist_id', 'statistic_type_id'],
+        set_={column: stmt.excluded[column] for column in UPSERT_COLUMNS}
+      )
+      sql_session.execute(stmt)
+    if commit:
+      sql_session.commit()
+    return len(rows)
@@ -1,7 +1,7 @@
-import requests
 import json
 from ytmusicapi import YTMusic
 from .errors import ErrorResponse
+from .http_sessions import session_for
 from .evaluation import CopyrightEvaluator
 
 class YoutubeClient():
@@ -14,7 +14,7 @@ class YoutubeClient():
   
   def get(self, path, data=None, alt_token = False):
     data['key'] = self.token if alt_token == False else self.alt_token
-    res = requests.get(f"https://www.googleapis.com/youtube/v3{path}", headers= {
+    res = session_for(self.root_uri).get(f"https://www.googleapis.com/youtube/v3{path}", headers= {
       "Content-Type": "application/json"
     },
     params=data)
@@ -16,7 +16,9 @@ from controllers.playlists import PlaylistController
 from controllers.twilio import TwilioController
 from cron_jobs import eval_cron, stats_cron, onboarding_cron, spotify_cron
 from lib.stripe_client import StripeController
+from lib.spotify_tokens import SpotifyTokenStore
 from lib.utils import get_function_url
+from lib.firestore_scan import ScanCheckpoint, page_query, page_cursors
 from lib.config import *
 from lib import Artist, SpotifyClient, AirtableClient, YoutubeClient, SongstatsClient, ErrorResponse, get_user, \
     CloudSQLClient, LinkSource, OrganizationArtist, StatisticType, \
@@ -74,6 +76,8 @@ def get_tag_types():
     })
 
 sql = CloudSQLClient(PROJECT_ID, LOCATION, SQL_INSTANCE, SQL_USER, SQL_PASSWORD, SQL_DB)
+# Spotify access tokens are shared by every client in the instance and persisted for cold starts
+spotify_token_store = SpotifyTokenStore(sql.get_session)
 def get_songstats_client(db=None):
     return SongstatsClient(SONGSTATS_API_KEY, db)
 
@@ -191,19 +195,22 @@ def lookaliketask(req: tasks_fn.CallableRequest) -> str:
 def reimportsql(req: tasks_fn.CallableRequest) -> str:
 
     count = int(req.data.get('size', 50))
-    page = int(req.data.get('page', 0))
+    cursor = req.data.get('cursor', None)
+    run = req.data.get('run', None)
 
-    page, updated, found, new = reimport_artists_eval(page, count)
-    print("Page: " + str(page) + " Found: " + str(found) + " Updated: " + str(updated) + " new: " + str(new))
-    return "Page: " + str(page) + " Found: " + str(found) + " Updated: " + str(updated) + " new: " + str(new)
+    next_cursor, updated, found, new = reimport_artists_eval(cursor, count)
+    if run is not None:
+        ScanCheckpoint(firestore.client(app), run).complete(cursor)
+    print("Cursor: " + str(cursor) + " Found: " + str(found) + " Updated: " + str(updated) + " new: " + str(new))
+    return "Cursor: " + str(cursor) + " Found: " + str(found) + " Updated: " + str(updated) + " new: " + str(new)
 
-def reimport_artists_eval(page = 0, page_size = 50):
+def reimport_artists_eval(cursor = None, page_size = 50):
     db = firestore.client(app)
     spotify = get_spotify_client()
 
     tracking_controller = TrackingController(spotify, get_songstats_client(db), db)
-    offset = page * page_size
-    old_artists = db.collection("artists_v2").limit(page_size).offset(offset).get()
+    old_artists = list(page_query(db.collection("artists_v2"), page_size, cursor).stream())
+    next_cursor = old_artists[-1].id if len(old_artists) == page_size else None
     spotifys = list(map(lambda x: x.get('spotify_id'), old_artists))
 
     sql_session = sql.get_session()
@@ -212,15 +219,15 @@ def reimport_artists_eval(page = 0, page_size = 50):
     new = 0
     existing = sql_session.scalars(
         select(Artist).options(joinedload(Artist.evaluation)).where(Artist.spotify_id.in_(spotifys))).all()
+    existing_map = {a.spotify_id: a for a in existing}
     evalIds = list()
+    new_artists = list()
     for artist in old_artists:
         spotify_id = artist.get('spotify_id')
-        add_batch = list()
-        existingMatches = list(filter(lambda x: x.spotify_id == spotify_id, existing))
+        existingMatch = existing_map.get(spotify_id)
 
-        if len(existingMatches) > 0:
+        if existingMatch is not None:
             found += 1
-            existingMatch = existingMatches[0]
             status = 1
             if artist.get('eval_status') == 'unsigned':
                 status = 0
@@ -242,12 +249,14 @@ def reimport_artists_eval(page = 0, page_size = 50):
         else:
             new += 1
             print("Adding artist: " + spotify_id)
-            tracking_controller.import_sql(sql_session, artist)
+            new_artists.append(artist)
     if len(evalIds) > 0:
         sql_session.commit()
+    if len(new_artists) > 0:
+        tracking_controller.import_sql_bulk(sql_session, new_artists)
 
     sql_session.close()
-    return page, updated, found, new
+    return next_cursor, updated, found, new
 
 
 def bulk_update(sql_session, ids: list, set: str):
@@ -318,27 +327,35 @@ def fn_v2_api(req: https_fn.Request) -> https_fn.Response:
             data = flask.request.get_json()
         else:
             data = {}
-        total = int(db.collection('artists_v2').count().get()[0][0].value)
-        count = data.get('pageSize', 500)
-        total_pages = math.ceil(total / count)
-        if data.get('page', None) is not None:
-            page, updated, found, new = reimport_artists_eval(page = data.get('page', 0), page_size = data.get('pageSize', 250))
+        count = int(data.get('pageSize', 500))
+        if 'cursor' in data:
+            next_cursor, updated, found, new = reimport_artists_eval(cursor = data.get('cursor'), page_size = count)
             return {
-                "page": page,
+                "cursor": data.get('cursor'),
+                "next_cursor": next_cursor,
                 "updated": updated,
                 "new": new,
                 "found": found,
-                "total_pages": total_pages,
             }
+        # a run fans every page out up front, keyed by the cursor it starts after; passing
+        # an earlier run re-dispatches just the pages that run didn't complete
+        checkpoint = ScanCheckpoint(db, data.get('run') or 'reimport-' + datetime.now().strftime('%Y%m%d%H%M%S'))
+        checkpoint_data = checkpoint.load() if data.get('run') else None
+        if checkpoint_data is not None:
+            count = int(checkpoint_data.get('page_size', count))
+            cursors = checkpoint.pending(checkpoint_data)
+        else:
+            cursors = page_cursors(db.collection('artists_v2'), count)
+            checkpoint.start(cursors, count)
         task_queue = functions.task_queue("reimportsql")
         target_uri = get_function_url("reimportsql")
 
-        for i in range(total_pages + 1):
-            body = {"data": {"page": i, "size": count}}
+        for cursor in cursors:
+            body = {"data": {"cursor": cursor, "size": count, "run": checkpoint.name}}
             task_options = functions.TaskOptions(schedule_time=datetime.now(),
                                                  uri=target_uri)
             task_queue.enqueue(body, task_options)
-        return https_fn.Response(status=200, response=f"Enqueued {total_pages + 1} tasks")
+        return https_fn.Response(status=200, response=f"Enqueued {len(cursors)} tasks for run {checkpoint.name}")
 
 
     @v2_api.post("/import-artists")
@@ -349,18 +366,16 @@ def fn_v2_api(req: https_fn.Request) -> https_fn.Response:
             data = {}
 
         count = int(data.get('size', 50))
-        page = int(data.get('page', 0))
-        offset = page * count
+        cursor = data.get('cursor', None)
         total = int(db.collection('artists_v2').count().get()[0][0].value)
-        old_artists = db.collection("artists_v2").limit(count).offset(offset).get()
-
+        old_artists = list(page_query(db.collection("artists_v2"), count, cursor).stream())
 
-
-        imported, skipped, avg, fails = tracking_controller.import_sql(sql_session, old_artists)
+        imported, skipped, avg, fails = tracking_controller.import_sql_bulk(sql_session, old_artists)
 
         return {
             'totalPages': math.ceil(total / count),
-            'page': page,
+            'cursor': cursor,
+            'nextCursor': old_artists[-1].id if len(old_artists) == count else None,
             'size': count,
             'imported': imported,
             'skipped': skipped,
@@ -394,13 +409,25 @@ def fn_v2_api(req: https_fn.Request) -> https_fn.Response:
 
         for artist in artists_data:
             spotify_id_to_artist_id[artist.spotify_id] = artist.id
-        artists = get_spotify_client().get_cached(spotify_ids, 'artist', timedelta(days=1))
+        spotify = get_spotify_client()
+        with spotify.deferred_cache_writes():
+            artists = spotify.get_cached(spotify_ids, 'artist', timedelta(days=1))
         artist_ids_to_update = []
         for artist in artists:
             artist_ids_to_update.append(str(spotify_id_to_artist_id[artist['id']]))
 
         if (len(artist_ids_to_update) > 0):
             bulk_update(sql_session, artist_ids_to_update, 'spotify_cached_at = NOW(), spotify_queued_at = NULL')
+
+        # warm the album caches for the whole batch so the per artist evals that follow are cache hits;
+        # best effort, the artists are already cached
+        try:
+            with spotify.deferred_cache_writes():
+                spotify.get_artists_recent_plines_with_dates(spotify_ids, ignore_errors=True)
+        except Exception as e:
+            print("Album cache warm-up failed: " + str(e))
+        print("Spotify memory cache: " + str(spotify.memory_cache_stats()))
+        print("Negative cache: " + str(spotify.negative_cache_stats()))
         return 'Cached ' + str(len(artists)) + " artist(s)", 200
 
     @v2_api.post("/spotify-cache-ids")
@@ -412,7 +439,9 @@ def fn_v2_api(req: https_fn.Request) -> https_fn.Response:
             return 'Cached 0 artists', 200
         spotify_ids = data['spotify_ids']
 
-        artists = get_spotify_client().get_cached(spotify_ids, 'artist', timedelta(days=1))
+        spotify = get_spotify_client()
+        with spotify.deferred_cache_writes():
+            artists = spotify.get_cached(spotify_ids, 'artist', timedelta(days=1))
 
         return 'Cached ' + str(len(artists)) + " artist(s)", 200
 
@@ -521,6 +550,14 @@ def fn_v2_api(req: https_fn.Request) -> https_fn.Response:
         print('spotify_id/artist_id',str(spotify_id),str(artist_id))
         return tracking_controller.update_artist(sql_session, spotify_id, artist_id, datetime.now() - timedelta(days=1))
 
+    @v2_api.post("/update-artists")
+    def update_artists():
+        data = flask.request.get_json()
+        if 'ids' not in data:
+            raise ErrorResponse("Invalid payload. Must include 'ids'", 500)
+        print('artist_ids', str(data['ids']))
+        return tracking_controller.update_artists(sql_session, data['ids'], get_task_controller())
+
     @v2_api.post("/run-alerts")
     def run_all_alerts():
         try:
@@ -604,8 +641,8 @@ def fn_v2_update_job(event: scheduler_fn.ScheduledEvent) -> None:
 
     try:
 
-        # only looks at artists who are ingested, updates 750 stats per hour
-        stats_cron(sql_session, task_controller, tracking_controller, 25, bulk_update)
+        # only looks at artists who are ingested, updates 3k stats per hour in /update-artists batches
+        stats_cron(sql_session, task_controller, tracking_controller, 100, bulk_update)
 
     except Exception as e:
         print(str(e))
@@ -1336,9 +1373,9 @@ def get_task_controller():
 
     return task_controller
 
-def get_spotify_client():
+def get_spotify_client(rate_limit_wait=True):
     # if spotify_client is None:
-    spotify_client = SpotifyClient(firestore.client(app), SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_ALT_CLIENT_ID, SPOTIFY_ALT_CLIENT_SECRET, SPOTIFY_USER_FACING_CLIENT_ID, SPOTIFY_USER_FACING_CLIENT_SECRET)
+    spotify_client = SpotifyClient(firestore.client(app), SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, SPOTIFY_ALT_CLIENT_ID, SPOTIFY_ALT_CLIENT_SECRET, SPOTIFY_USER_FACING_CLIENT_ID, SPOTIFY_USER_FACING_CLIENT_SECRET, SPOTIFY_CACHE_LAYOUT, spotify_token_store, rate_limit_wait)
 
     return spotify_client
 
@@ -1350,7 +1387,8 @@ def get_youtube_client():
     return youtube_client
 
 def process_spotify_link(sql_session, uid, spotify_url, tags = None, preview = False ):
-    spotify = get_spotify_client()
+    # previews are user facing, fail fast rather than queue behind the rate limiter
+    spotify = get_spotify_client(rate_limit_wait=not preview)
     task_controller = get_task_controller()
     try:
         db = firestore.client(app)
@@ -1458,6 +1496,24 @@ def process_spotify_link(sql_session, uid, spotify_url, tags = None, preview = F
                         sql_session.add(sql_playlist)
                         sql_session.commit()
 
+                        # re-import: skip the artists an earlier import of this playlist added successfully
+                        # and the org still tracks; failed ones are retried and archived or removed ones
+                        # go through add_artist again, which restores them
+                        imported_ids = set(sql_session.scalars(select(ImportArtist.spotify_id)
+                            .join(Import, ImportArtist.import_id == Import.id)
+                            .where(Import.playlist_id == sql_playlist.id)
+                            .where(ImportArtist.status == 2)).all())
+                        if len(imported_ids) > 0:
+                            imported_ids = set(sql_session.scalars(select(Artist.spotify_id)
+                                .join(OrganizationArtist, OrganizationArtist.artist_id == Artist.id)
+                                .where(OrganizationArtist.organization_id == user_data.get('organization'))
+                                .where(or_(OrganizationArtist.archived == False, OrganizationArtist.archived == None))
+                                .where(Artist.spotify_id.in_(imported_ids))).all())
+                        artists = list(filter(lambda x: x['id'] not in imported_ids, artists))
+                        aids = list(filter(lambda x: x not in imported_ids, aids))
+                        if len(aids) == 0:
+                            return {'message': 'No new artists since the last import', 'status': 200, 'added_count': 0}
+
                     sql_playlist_dict = sql_playlist.as_dict()
 
                     import_obj = Import(
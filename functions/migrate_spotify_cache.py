@@ -0,0 +1,93 @@
+"""
+One-time migration: rewrite the spotify_cache collection from auto-ID documents to the keyed
+layout ({type}:{spotify_id}). When several documents exist for the same object, the newest one wins.
+Legacy documents are deleted once they have been copied.
+
+Run this, then set SPOTIFY_CACHE_LAYOUT="keyed" and redeploy.
+
+Usage:
+  cd functions
+  GOOGLE_APPLICATION_CREDENTIALS=creds/artist-tracker-e5cce-firebase-adminsdk-uvels-b413329744.json venv/bin/python3 migrate_spotify_cache.py
+"""
+
+from google.cloud import firestore
+
+from lib.firestore_batch import BatchWriter
+
+# a page can mean up to two writes per doc (keyed set + legacy delete); BatchWriter splits them into
+# commits under the 500 op limit and the smaller page keeps large playlist docs under the request size cap
+PAGE_SIZE = 250
+
+
+def keyed_id(data):
+    return f"{data.get('type')}:{data.get('spotify_id')}"
+
+
+def main():
+    db = firestore.Client()
+    print("Connected to Firestore")
+    collection = db.collection('spotify_cache')
+
+    total = 0
+    migrated = 0
+    dropped_dupes = 0
+    skipped_invalid = 0
+    last_doc = None
+
+    while True:
+        query = collection.order_by('__name__').limit(PAGE_SIZE)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = query.get()
+        if len(docs) == 0:
+            break
+        last_doc = docs[-1]
+
+        # newest legacy document per key on this page
+        newest = {}
+        legacy = []
+        for doc in docs:
+            if ':' in doc.id:
+                continue
+            total += 1
+            data = doc.to_dict()
+            if data.get('type') is None or data.get('spotify_id') is None:
+                skipped_invalid += 1
+                continue
+            legacy.append(doc)
+            key = keyed_id(data)
+            current = newest.get(key)
+            if current is None or (data.get('created_at') and current.get('created_at') and data.get('created_at') > current.get('created_at')):
+                newest[key] = data
+
+        if len(legacy) == 0:
+            continue
+
+        # compare against keyed documents that already exist (live writes or earlier pages)
+        keyed_refs = [collection.document(key) for key in newest]
+        existing = {snap.id: snap.to_dict() for snap in db.get_all(keyed_refs) if snap.exists}
+
+        batch = BatchWriter(db)
+        for key, data in newest.items():
+            current = existing.get(key)
+            if current is not None and current.get('created_at') and data.get('created_at') and current.get('created_at') >= data.get('created_at'):
+                dropped_dupes += 1
+                continue
+            data.pop('id', None)
+            batch.set(collection.document(key), data)
+            migrated += 1
+        for doc in legacy:
+            batch.delete(doc.reference)
+        dropped_dupes += len(legacy) - len(newest)
+        batch.flush()
+        print(f"  Migrated page ({total} legacy docs processed, {migrated} keyed docs written)")
+
+    print("\nDone!")
+    print(f"  Legacy documents processed: {total}")
+    print(f"  Keyed documents written: {migrated}")
+    print(f"  Duplicates dropped: {dropped_dupes}")
+    print(f"  Invalid documents skipped: {skipped_invalid}")
+
+
+if __name__ == '__main__':
+    main()